@@ -0,0 +1,226 @@
+#! /usr/bin/env python
+"""
+Benchmarks for scholar.py's parsers and querier.  The parse-only cases
+run the parsers on the saved pages in the fixtures directory.  The
+end-to-end cases run ScholarQuerier against FixtureServer, a local
+stand-in for Scholar that serves the same pages at Scholar's URL
+paths.  Each case runs in a child process of its own, so that the
+reported peak memory is the case's own.
+
+Use --save to keep the results as JSON, and --baseline to compare a
+later run against them: the script exits non-zero when a case got
+slower than the tolerance allows.
+"""
+import BaseHTTPServer
+import SocketServer
+import json
+import multiprocessing
+import optparse
+import os
+import resource
+import sys
+import threading
+import time
+import urlparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(HERE, 'fixtures')
+sys.path.insert(0, os.path.dirname(HERE))
+
+import scholar
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name + '.html'), 'rb') as fh:
+        return fh.read()
+
+def route(url):
+    """
+    Returns the name of the fixture page that stands in for the Scholar
+    page at the given URL, or None.
+    """
+    parts = urlparse.urlsplit(url)
+    args = urlparse.parse_qs(parts.query)
+    if parts.path == '/scholar':
+        return 'results'
+    if parts.path == '/citations':
+        view_op = args.get('view_op', [None])[-1]
+        if view_op == 'search_authors':
+            return 'author_search'
+        if view_op == 'view_citation':
+            return 'citation_view'
+        if 'user' in args:
+            return 'profile'
+    return None
+
+class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        name = route(self.path)
+        if name is None:
+            self.send_error(404)
+            return
+        body = self.server.pages[name]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+class FixtureServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A local HTTP server that answers Scholar's URL paths with the
+    fixture pages, after an optional latency in seconds.  Point a
+    querier at it via ScholarQuerier(site=server.site).
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FixtureHandler)
+        self.latency = latency
+        self.pages = dict([(name, fixture(name)) for name in
+                           ('results', 'author_search', 'profile', 'citation_view')])
+
+    @property
+    def site(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class FixtureQuerier(scholar.ScholarQuerier):
+    """
+    A querier that serves its requests from the fixtures directly, to
+    measure parsing without any network in the way.
+    """
+    def _fetch(self, url):
+        return fixture(route(url))
+
+# Every case runs one iteration, returning the number of pages and
+# articles processed:
+
+def parse_results(site):
+    querier = FixtureQuerier()
+    querier.parse(fixture('results'))
+    return 1, len(querier.articles)
+
+def parse_author_search(site):
+    querier = FixtureQuerier()
+    querier.parse_author_page(fixture('author_search'))
+    return 1, 0
+
+def parse_citation_view(site):
+    querier = FixtureQuerier()
+    querier.parse_citation_view(fixture('citation_view'))
+    return 1, 0
+
+def parse_profile(site):
+    querier = FixtureQuerier(workers=1)
+    querier.parse_citation_page(fixture('profile'))
+    return 1 + len(querier.articles), len(querier.articles)
+
+def query(site):
+    querier = scholar.ScholarQuerier(author='einstein', site=site)
+    querier.query('quantum')
+    return 1, len(querier.articles)
+
+def query_author(site):
+    querier = scholar.ScholarQuerier(author='einstein', search_author=True, site=site)
+    querier.query_author('')
+    return 2 + len(querier.articles), len(querier.articles)
+
+CASES = [('parse_results', parse_results, 20),
+         ('parse_author_search', parse_author_search, 200),
+         ('parse_citation_view', parse_citation_view, 200),
+         ('parse_profile', parse_profile, 5),
+         ('query', query, 20),
+         ('query_author', query_author, 3)]
+
+def run_case(func, site, number, repeat, results):
+    func(site) # Warm up
+    best = None
+    for _ in range(repeat):
+        pages = articles = 0
+        start = time.time()
+        for _ in range(number):
+            num_pages, num_articles = func(site)
+            pages += num_pages
+            articles += num_articles
+        elapsed = time.time() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, pages, articles)
+    elapsed, pages, articles = best
+    # ru_maxrss is in kilobytes on Linux:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    results.put({'pages_per_sec': pages / elapsed,
+                 'articles_per_sec': articles / elapsed,
+                 'peak_mb': peak})
+
+def main():
+    usage = """bench_scholar.py [options] [case ...]
+Benchmarks scholar.py's parsers and querier on saved Scholar pages."""
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('-n', '--number', type='float', metavar='F',
+                      help='Scale the number of iterations per round by F')
+    parser.add_option('-r', '--repeat', type='int', metavar='N',
+                      help='Rounds per case, the best one gets reported (default: 3)')
+    parser.add_option('--latency', type='float', metavar='SECS',
+                      help='Latency of the stand-in server (default: 0)')
+    parser.add_option('--save', metavar='FILE',
+                      help='Save the results as JSON to FILE')
+    parser.add_option('--baseline', metavar='FILE',
+                      help='Compare against results saved earlier')
+    parser.add_option('--tolerance', type='float', metavar='F',
+                      help='Allowed slowdown against the baseline (default: 0.2)')
+    parser.set_defaults(number=1.0, repeat=3, latency=0.0, tolerance=0.2)
+    options, args = parser.parse_args()
+
+    cases = [case for case in CASES if not args or case[0] in args]
+    server = FixtureServer(options.latency)
+    server.start()
+
+    report = {}
+    print '%-20s %12s %14s %9s' % ('case', 'pages/sec', 'articles/sec', 'peak MB')
+    for name, func, number in cases:
+        results = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=run_case,
+                                       args=(func, server.site, max(1, int(number * options.number)),
+                                             options.repeat, results))
+        proc.start()
+        report[name] = results.get()
+        proc.join()
+        print '%-20s %12.1f %14.1f %9.1f' % (name, report[name]['pages_per_sec'],
+                                            report[name]['articles_per_sec'],
+                                            report[name]['peak_mb'])
+    server.stop()
+
+    if options.save:
+        with open(options.save, 'w') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as fh:
+            baseline = json.load(fh)
+        regressions = 0
+        for name in sorted(report):
+            if name not in baseline:
+                continue
+            ratio = report[name]['pages_per_sec'] / baseline[name]['pages_per_sec']
+            if ratio < 1 - options.tolerance:
+                print 'REGRESSION %s: %.0f%% of baseline throughput' % (name, ratio * 100)
+                regressions += 1
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
 #! /usr/bin/env python
 """
 This module provides classes for querying Google Scholar and parsing
-returned results.  It currently *only* processes the first results
-page.  It is not a recursive crawler.
+returned results.  ScholarQuerier.query() processes the first results
+page, ScholarQuerier.iter_articles() pages through further results.
+ScholarCrawler follows the "cited by" lists of articles.
 """
 # Version: 1.5 -- $Date: 2012-09-27 10:44:39 -0700 (Thu, 27 Sep 2012) $
 #
@@ -62,75 +63,422 @@ page.  It is not a recursive crawler.
 # POSSIBILITY OF SUCH DAMAGE.
 
 import optparse
+import BaseHTTPServer
+import SocketServer
+import array
+import collections
+import contextlib
+import itertools
+import json
+import operator
+import os
+import random
 import sys
 import re
+import threading
+import time
+import hashlib
+import httplib
+import socket
+import tempfile
 import urllib
 import urllib2
-from BeautifulSoup import BeautifulSoup
-from cookielib import CookieJar
+import urlparse
+import zlib
+import Queue
+from cStringIO import StringIO
+from collections import OrderedDict
+
+# The modules above are cheap to import, or urllib2 imports them anyway.
+# BeautifulSoup, cookielib, sqlite3 and the other modules that only some
+# commands need get imported where they are used, as in _Strainer, so
+# that short invocations start fast.
+
+class _Strainer(object):
+    """
+    The arguments of a SoupStrainer, which gets built when first used.
+    """
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self._strainer = None
+
+    def build(self):
+        if self._strainer is None:
+            from BeautifulSoup import SoupStrainer
+            self._strainer = SoupStrainer(*self.args, **self.kwargs)
+        return self._strainer
+
+def _partial_soup(html, strainer, marker):
+    """
+    Builds a BeautifulSoup parse tree of only those parts of the HTML
+    document that the given _Strainer matches.  Since everything
+    before the first occurrence of the marker string cannot match, the
+    tag containing the marker is where tokenizing starts.
+    """
+    from BeautifulSoup import BeautifulSoup
+    idx = html.find(marker)
+    if idx > 0:
+        start = html.rfind('<', 0, idx)
+        if start > 0:
+            html = html[start:]
+    return BeautifulSoup(html, parseOnlyThese=strainer.build())
+
+_NONWORD_RE = re.compile(r'\W+', re.UNICODE)
+
+def _normalize_title(title):
+    """
+    Returns the title in lowercase, with runs of punctuation and
+    whitespace collapsed into single blanks, for matching titles that
+    Scholar renders slightly differently.
+    """
+    return _NONWORD_RE.sub(' ', title.lower()).strip()
 
-class Article():
+class Article(object):
     """
     A class representing articles listed on Google Scholar.  The class
-    provides basic dictionary-like behavior.
+    provides basic dictionary-like behavior.  The known fields are kept
+    in slots; other keys may be added and are rendered after them.
     """
+    # The known fields, in rendering order, with their labels:
+    FIELDS = (('title',         'Title'),
+              ('authors',       'Authors'),
+              ('url',           'URL'),
+              ('num_citations', 'Citations'),
+              ('num_versions',  'Versions'),
+              ('url_citations', 'Citations list'),
+              ('url_versions',  'Versions list'),
+              ('year',          'Year'),
+              ('journal',       'Journal'))
+    KEYS = tuple([key for key, label in FIELDS])
+    LABELS = dict(FIELDS)
+
+    __slots__ = KEYS + ('_keys', '_extras')
+
+    # Rendering layouts, one per distinct sequence of keys. Articles
+    # with the same keys share the same tuple, and thus the same layout:
+    _layouts = {}
+
     def __init__(self):
-        self.attrs = {'title':         [None, 'Title',          0],
-                      'authors':       [None, 'Authors',        1],
-                      'url':           [None, 'URL',            2],
-                      'num_citations': [0,    'Citations',      3],
-                      'num_versions':  [0,    'Versions',       4],
-                      'url_citations': [None, 'Citations list', 5],
-                      'url_versions':  [None, 'Versions list',  6],
-                      'year':          [None, 'Year',           7],
-                      'journal':       [None, 'Journal',        8]}
+        self.title = None
+        self.authors = None
+        self.url = None
+        self.num_citations = 0
+        self.num_versions = 0
+        self.url_citations = None
+        self.url_versions = None
+        self.year = None
+        self.journal = None
+        self._keys = self.KEYS
+        self._extras = None
 
     def __getitem__(self, key):
-        if key in self.attrs:
-            return self.attrs[key][0]
+        if key in self.LABELS:
+            return getattr(self, key)
+        if self._extras is not None:
+            return self._extras.get(key)
         return None
 
     def __setitem__(self, key, item):
-        if key in self.attrs:
-            self.attrs[key][0] = item
-        else:
-            self.attrs[key] = [item, key, len(self.attrs)]
+        if key in self.LABELS:
+            setattr(self, key, item)
+            if self._keys is not self.KEYS and key not in self._keys:
+                self._set_keys(self._keys + (key,))
+            return
+        if self._extras is None:
+            self._extras = {}
+        if key not in self._extras:
+            self._set_keys(self._keys + (key,))
+        self._extras[key] = item
 
     def __delitem__(self, key):
-        if key in self.attrs:
-            del self.attrs[key]
+        if key not in self._keys:
+            return
+        if key in self.LABELS:
+            setattr(self, key, None)
+        else:
+            del self._extras[key]
+        self._set_keys(tuple([k for k in self._keys if k != key]))
+
+    @property
+    def attrs(self):
+        """
+        The article's fields as a dictionary mapping each key to its
+        value, label and rendering position, like older versions of
+        this class kept them.  This is a copy.
+        """
+        layout = self._layout()
+        return dict([(key, [val, label, idx]) for idx, (key, val, label)
+                     in enumerate(zip(self._keys, layout['values'](self),
+                                      layout['labels']))])
 
     def as_txt(self):
-        # Get items sorted in specified order:
-        items = sorted(self.attrs.values(), key=lambda item: item[2])
-        # Find largest label length:
-        max_label_len = max([len(str(item[1])) for item in items])
-        fmt = '%%%ds %%s' % max_label_len
-        return '\n'.join([fmt % (item[1], item[0]) for item in items])
+        layout = self._layout()
+        return layout['txt'] % layout['values'](self)
 
     def as_csv(self, header=False, sep='|'):
-        # Get keys sorted in specified order:
-        keys = [pair[0] for pair in \
-                    sorted([(key, val[2]) for key, val in self.attrs.items()],
-                           key=lambda pair: pair[1])]
         res = []
         if header:
-            res.append(sep.join(keys))
-        res.append(sep.join([unicode(self.attrs[key][0]) for key in keys]))
+            res.append(sep.join(self._keys))
+        res.append(sep.join([unicode(val) for val in self._layout()['values'](self)]))
         return '\n'.join(res)
 
+    def as_dict(self):
+        return OrderedDict(zip(self.keys(), self.values()))
+
+    def keys(self):
+        """
+        The article's keys, in rendering order.
+        """
+        return self._keys
+
+    def values(self):
+        """
+        The article's values, as a tuple in the order of keys().
+        """
+        return self._layout()['values'](self)
+
+    def project(self, keys):
+        """
+        Limits the article's keys, and thus what gets rendered, to the
+        given ones, in the given order.
+        """
+        self._set_keys(tuple(keys))
+
+    def _set_keys(self, keys):
+        # Intern the key sequence so that articles with the same keys
+        # share one tuple, and one layout:
+        layout = self._layouts.get(keys)
+        self._keys = keys if layout is None else layout['keys']
+
+    def _layout(self):
+        layout = self._layouts.get(self._keys)
+        if layout is None:
+            layout = self._make_layout(self._keys)
+            self._layouts[self._keys] = layout
+        return layout
+
+    @classmethod
+    def _make_layout(cls, keys):
+        labels = [cls.LABELS.get(key, key) for key in keys]
+        # Find largest label length, and build the text format:
+        max_label_len = max([len(str(label)) for label in labels])
+        txt = '\n'.join([label.rjust(max_label_len).replace('%', '%%') + ' %s'
+                         for label in labels])
+        if len(keys) > 1 and all([key in cls.LABELS for key in keys]):
+            values = operator.attrgetter(*keys)
+        else:
+            values = lambda art: tuple([art[key] for key in keys])
+        return {'keys': keys, 'labels': labels, 'txt': txt, 'values': values}
+
+class ScholarCancelled(Exception):
+    """
+    Raised by a ScholarFuture whose call got cancelled before it ran.
+    """
+
+def _queue_get(queue):
+    """
+    Returns the next item of the given Queue.Queue, waiting in slices
+    like ScholarFuture.result(), so that Ctrl-C still interrupts the
+    main thread.
+    """
+    while True:
+        try:
+            return queue.get(timeout=0.5)
+        except Queue.Empty:
+            pass
+
+class ScholarFuture(object):
+    """
+    The pending result of a call handed to a ScholarWorkerPool.  The
+    result() method blocks until the call has completed and returns its
+    value, or re-raises the exception the call raised.  Callbacks added
+    via add_done_callback() run once the call completes.
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def exception(self):
+        """
+        Waits for the call to complete, and returns the exception it
+        raised, or None.
+        """
+        while not self._done.wait(0.5):
+            pass
+        return self._exc_info[1] if self._exc_info else None
+
+    def add_done_callback(self, func):
+        """
+        Arranges for func(future) to be called when the call completes,
+        from the thread that completed it.  If the call has completed
+        already, func runs right away.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+
+    def result(self):
+        # Wait in slices so that the main thread stays interruptible:
+        while not self._done.wait(0.5):
+            pass
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+class ScholarWorkerPool(object):
+    """
+    A small pool of daemon threads that runs submitted calls
+    concurrently, with at most 'workers' calls in flight at a time.
+    Calls start in submission order.
+    """
+    def __init__(self, workers=4):
+        self.workers = max(1, workers)
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Schedules func(*args, **kwargs) and returns a ScholarFuture
+        for its result.
+        """
+        future = ScholarFuture()
+        self._queue.put((future, func, args, kwargs))
+        self._start()
+        return future
+
+    def map(self, func, items):
+        """
+        Like the builtin map(), but runs the calls concurrently.  The
+        results come back in the order of the given items.
+        """
+        futures = [self.submit(func, item) for item in items]
+        return [future.result() for future in futures]
+
+    def shutdown(self, cancel=False):
+        """
+        Stops the worker threads once all pending calls have run.  With
+        cancel, calls that have not started yet are dropped instead, and
+        their futures raise ScholarCancelled.
+        """
+        if cancel:
+            while True:
+                try:
+                    task = self._queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if task is not None:
+                    try:
+                        raise ScholarCancelled('call cancelled')
+                    except ScholarCancelled:
+                        task[0].set_exception(sys.exc_info())
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _start(self):
+        with self._lock:
+            if len(self._threads) >= self.workers:
+                return
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            future, func, args, kwargs = task
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+
 class ScholarParser():
     """
     ScholarParser can parse HTML document strings obtained from Google
     Scholar. It invokes the handle_article() callback on each article
     that was parsed successfully.
+
+    Extraction is driven by a rule table per page layout: the table
+    maps the (tag name, class) of elements within a result to the
+    method that extracts fields from them.  Each result's subtree is
+    walked once, and each rule applies to the first element it matches.
+    Unless the class pins a layout, the parser detects it from a cheap
+    fingerprint of the page, and keeps using it for later pages as long
+    as it yields articles.  Given the fields wanted, the parser skips
+    the rules that extract none of them.  Titles always get extracted.
     """
     SCHOLAR_SITE = 'http://scholar.google.com'
 
-    def __init__(self, site=None):
+    # Only the result divs get turned into a parse tree:
+    STRAINER = _Strainer('div', {'class': 'gs_r'})
+    MARKER = 'class="gs_r"'
+
+    # The results page layouts, with the rules for extracting their
+    # fields.  Layout 'classic' predates February 2012, '2012' covers
+    # the changes from 02/01/12 and 07/26/12:
+    LAYOUTS = {
+        'classic': {('div', 'gs_rt'):  '_parse_title_div',
+                    ('span', 'gs_fl'): '_parse_links'},
+        '2012':    {('h3', 'gs_rt'):   '_parse_title',
+                    ('div', 'gs_a'):   '_parse_year',
+                    ('div', 'gs_fl'):  '_parse_links'},
+    }
+
+    # Fingerprints telling the layouts apart, checked in order:
+    FINGERPRINTS = (('2012',    '<h3 class="gs_rt"'),
+                    ('classic', '<div class="gs_rt"'))
+
+    # The fields that the rules' methods extract:
+    RULE_FIELDS = {'_parse_title':     ('title', 'url'),
+                   '_parse_title_div': ('title', 'url'),
+                   '_parse_year':      ('year',),
+                   '_parse_links':     ('num_citations', 'num_versions',
+                                        'url_citations', 'url_versions')}
+
+    # A fixed layout, or None to detect it:
+    LAYOUT = None
+    DEFAULT_LAYOUT = '2012'
+
+    def __init__(self, site=None, stats=None, fields=None):
         self.soup = None
         self.article = None
         self.site = site or self.SCHOLAR_SITE
+        self.stats = stats
+        # The wanted fields, or None for all:
+        self.fields = set(fields) if fields else None
+        self.layout = self.LAYOUT
+        self.rules = self._rules(self.LAYOUT or self.DEFAULT_LAYOUT)
         self.year_re = re.compile(r'\b(?:20|19)\d{2}\b')
 
     def handle_article(self, art):
@@ -138,35 +486,113 @@ class ScholarParser():
         In this base class, the callback does nothing.
         """
 
+    def handle_dropped(self, art):
+        """
+        Invoked for articles that could not be parsed completely, such
+        as those without a title.  In this base class, the callback does
+        nothing.
+        """
+
+    def detect_layout(self, html):
+        """
+        Returns the name of the layout the given results page uses.
+        """
+        for layout, fingerprint in self.FINGERPRINTS:
+            if fingerprint in html:
+                return layout
+        return self.DEFAULT_LAYOUT
+
     def parse(self, html):
         """
         This method initiates parsing of HTML content.
         """
-        self.soup = BeautifulSoup(html)
-        for div in self.soup.findAll(ScholarParser._tag_checker):
+        start = time.time()
+        self.soup = _partial_soup(html, self.STRAINER, self.MARKER)
+        soup_done = time.time()
+        # The strainer leaves the result divs at the top of the tree:
+        divs = self.soup.findAll(ScholarParser._tag_checker, recursive=False)
+
+        layout = self.get_layout()
+        cached = layout is not None and self.LAYOUT is None
+        if layout is None:
+            layout = self.detect_layout(html)
+        articles = self._parse_articles(divs, layout)
+        if cached and divs and not [art for art in articles if art['title']]:
+            # Scholar may have changed the layout since we cached it:
+            layout = self.detect_layout(html)
+            articles = self._parse_articles(divs, layout)
+        self.set_layout(layout)
+
+        for art in articles:
+            if art['title']:
+                self.handle_article(art)
+            else:
+                self.handle_dropped(art)
+
+        if self.stats is not None:
+            self.stats.time('soup', soup_done - start)
+            self.stats.time('extract', time.time() - soup_done)
+
+    def get_layout(self):
+        """
+        Returns the layout to use for the next page, or None when it
+        needs to be detected.
+        """
+        return self.layout
+
+    def set_layout(self, layout):
+        """
+        Remembers the layout that the last page used.
+        """
+        self.layout = layout
+
+    def _parse_articles(self, divs, layout):
+        self.rules = self._rules(layout)
+        articles = []
+        for div in divs:
             self._parse_article(div)
+            articles.append(self.article)
+        return articles
+
+    def _rules(self, layout):
+        rules = self.LAYOUTS[layout]
+        if self.fields is None:
+            return rules
+        wanted = self.fields | set(['title'])
+        return dict([(key, method) for key, method in rules.items()
+                     if wanted.intersection(self.RULE_FIELDS.get(method, wanted))])
 
     def _parse_article(self, div):
         self.article = Article()
+        self._walk(div, dict(self.rules))
 
-        for tag in div:
-            if not hasattr(tag, 'name'):
+    def _walk(self, tag, rules):
+        # Returns True once all rules have been applied.
+        for child in tag:
+            if not hasattr(child, 'name'):
                 continue
+            method = rules.pop((child.name, child.get('class')), None)
+            if method is not None:
+                getattr(self, method)(child)
+                if not rules:
+                    return True
+            elif child.contents and self._walk(child, rules):
+                return True
+        return False
 
-            if tag.name == 'div' and tag.get('class') == 'gs_rt' and \
-                    tag.h3 and tag.h3.a:
-                self.article['title'] = ''.join(tag.h3.a.findAll(text=True))
-                self.article['url'] = self._path2url(tag.h3.a['href'])
+    def _parse_title(self, tag):
+        if tag.a:
+            self.article['title'] = ''.join(tag.a.findAll(text=True))
+            if self.fields is None or 'url' in self.fields:
+                self.article['url'] = self._path2url(tag.a['href'])
 
-            if tag.name == 'font':
-                for tag2 in tag:
-                    if not hasattr(tag2, 'name'):
-                        continue
-                    if tag2.name == 'span' and tag2.get('class') == 'gs_fl':
-                        self._parse_links(tag2)
+    def _parse_title_div(self, tag):
+        if tag.h3:
+            self._parse_title(tag.h3)
 
-        if self.article['title']:
-            self.handle_article(self.article)
+    def _parse_year(self, tag):
+        year = self.year_re.findall(tag.text)
+        self.article['year'] = year[0] if len(year) > 0 else None
 
     def _parse_links(self, span):
         for tag in span:
@@ -211,63 +637,956 @@ class ScholarParser120201(ScholarParser):
     This class reflects update to the Scholar results page layout that
     Google recently.
     """
+    LAYOUT = '2012'
 
-    def _parse_article(self, div):
-        self.article = Article()
+class ScholarParser120726(ScholarParser):
+    """
+    This class reflects update to the Scholar results page layout that
+    Google made 07/26/12.
+    """
+    LAYOUT = '2012'
 
-        for tag in div:
-            if not hasattr(tag, 'name'):
-                continue
+class ScholarRateLimiter(object):
+    """
+    A token bucket that paces requests to 'rate' per second on average,
+    allowing bursts of up to 'burst' requests.  The rate adapts to the
+    server: slow_down() halves it, down to min_rate, and speed_up()
+    recovers it step by step.  Instances are thread-safe, so several
+    queriers can share one limiter.
+    """
+    def __init__(self, rate, burst=1, min_rate=None):
+        self.rate = self.max_rate = float(rate)
+        self.min_rate = min_rate or self.max_rate / 16
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request may go out.
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst,
+                                   self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self):
+        """
+        Halves the rate, as when the server throttles requests.
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
 
-            if tag.name == 'h3' and tag.get('class') == 'gs_rt' and tag.a:
-                self.article['title'] = ''.join(tag.a.findAll(text=True))
-                self.article['url'] = self._path2url(tag.a['href'])
+    def speed_up(self):
+        """
+        Raises the rate by a tenth of its maximum, as when a request
+        went through fine.
+        """
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
 
-            if tag.name == 'div' and tag.get('class') == 'gs_a':
-                year = self.year_re.findall(tag.text)
-                self.article['year'] = year[0] if len(year) > 0 else None
+class ScholarDeadlineExceeded(urllib2.URLError):
+    """
+    Raised by a ScholarScheduler when a request would go out after the
+    scheduler's deadline.
+    """
 
-            if tag.name == 'div' and tag.get('class') == 'gs_fl':
-                self._parse_links(tag)
+class ScholarScheduler(object):
+    """
+    The ScholarScheduler sits between queriers and the network.  It
+    paces requests through a rate limiter, gives every request a
+    timeout, and retries throttled (HTTP 429 and 503) and timed out
+    requests, with exponential backoff and jitter.  Once the optional
+    deadline, in seconds from creation, has passed, no more requests
+    go out, and queriers return the results gathered so far.  One
+    scheduler can serve several queriers.
+    """
+    RETRY_CODES = (429, 503)
+
+    def __init__(self, rate=None, timeout=30, retries=4, backoff=1.0,
+                 max_backoff=60, deadline=None, limiter=None):
+        self.limiter = limiter or (ScholarRateLimiter(rate) if rate else None)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = time.time() + deadline if deadline else None
+
+    def open(self, opener, req, stats=None):
+        """
+        Opens the given request via the opener, and returns the
+        response.  With a ScholarStats, every attempt to open the
+        request gets timed as an 'open' phase, and the time spent
+        waiting for the rate limiter and backing off as a 'wait' phase.
+        """
+        attempt = 0
+        waited = 0.0
+        while True:
+            self._check_deadline(req)
+            if self.limiter is not None:
+                start = time.time()
+                self.limiter.acquire()
+                waited += time.time() - start
+                self._check_deadline(req)
+
+            delay = 0
+            try:
+                start = time.time()
+                try:
+                    hdl = opener.open(req, timeout=self.timeout)
+                finally:
+                    if stats is not None:
+                        stats.time('open', time.time() - start)
+                        stats.time('wait', waited)
+                        waited = 0.0
+                if self.limiter is not None:
+                    self.limiter.speed_up()
+                return hdl
+            except urllib2.HTTPError, err:
+                if err.code not in self.RETRY_CODES or attempt >= self.retries:
+                    raise
+                if self.limiter is not None:
+                    self.limiter.slow_down()
+                delay = self._as_float(err.info().getheader('Retry-After'))
+            except urllib2.URLError, err:
+                if not isinstance(err.reason, socket.timeout) or attempt >= self.retries:
+                    raise
+            except socket.timeout:
+                if attempt >= self.retries:
+                    raise
+
+            # Back off exponentially, with jitter so that workers that
+            # got throttled together don't retry together:
+            delay = max(delay, min(self.max_backoff, self.backoff * 2 ** attempt)
+                        * random.uniform(0.5, 1.0))
+            if self.deadline is not None and time.time() + delay > self.deadline:
+                raise ScholarDeadlineExceeded('deadline exceeded: %s' % req.get_full_url())
+            time.sleep(delay)
+            waited += delay
+            attempt += 1
+
+    def _check_deadline(self, req):
+        if self.deadline is not None and time.time() > self.deadline:
+            raise ScholarDeadlineExceeded('deadline exceeded: %s' % req.get_full_url())
+
+    def _as_float(self, obj):
+        try:
+            return float(obj)
+        except (TypeError, ValueError):
+            return 0
 
-        if self.article['title']:
-            self.handle_article(self.article)
+class ScholarCacheMiss(urllib2.URLError):
+    """
+    Raised by an offline ScholarQuerier when a requested page is not in
+    its cache.
+    """
 
-class ScholarParser120726(ScholarParser):
+class ScholarCache(object):
     """
-    This class reflects update to the Scholar results page layout that
-    Google made 07/26/12.
+    A persistent on-disk cache of Scholar pages, keyed by the normalized
+    request URL.  Entries expire after a time-to-live that depends on
+    the kind of page requested, and the least recently used entries are
+    evicted once the cache exceeds max_size bytes.  In offline mode the
+    cache serves whatever it holds, regardless of age, and the querier
+    never touches the network.
     """
+    # Time-to-live in seconds, per kind of page:
+    TTLS = {'results':        24 * 3600,
+            'search_authors': 7 * 24 * 3600,
+            'list_works':     24 * 3600,
+            'view_citation':  30 * 24 * 3600,
+            'default':        24 * 3600}
+
+    def __init__(self, path, ttls=None, max_size=100 * 1024 * 1024, offline=False):
+        self.path = path
+        self.ttls = dict(self.TTLS)
+        self.ttls.update(ttls or {})
+        self.max_size = max_size
+        self.offline = offline
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self._size = sum([os.path.getsize(fname) for fname in self._entries()])
 
-    def _parse_article(self, div):
-        self.article = Article()
+    @staticmethod
+    def normalize(url):
+        """
+        Returns a canonical form of the given URL: lowercased scheme and
+        host, sorted query arguments, and no fragment.
+        """
+        parts = urlparse.urlsplit(url)
+        query = sorted(urlparse.parse_qsl(parts.query, keep_blank_values=True))
+        return urlparse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                                    parts.path or '/', urllib.urlencode(query), ''))
 
-        for tag in div:
-            if not hasattr(tag, 'name'):
-                continue
+    @staticmethod
+    def endpoint(url):
+        """
+        Returns the kind of Scholar page the given URL refers to, as used
+        to look up its time-to-live.
+        """
+        parts = urlparse.urlsplit(url)
+        if parts.path == '/scholar':
+            return 'results'
+        if parts.path == '/citations':
+            view_op = urlparse.parse_qs(parts.query).get('view_op')
+            if view_op:
+                return view_op[-1]
+        return 'default'
+
+    def get(self, url):
+        """
+        Returns the cached page for the given URL, or None if it is not
+        cached or has expired.
+        """
+        fname = self._fname(url)
+        try:
+            mtime = os.path.getmtime(fname)
+            if not self.offline and time.time() - mtime > self._ttl(url):
+                return None
+            with open(fname, 'rb') as fh:
+                html = fh.read()
+            # The access time records recency of use, for eviction:
+            os.utime(fname, (time.time(), mtime))
+            return html
+        except (IOError, OSError):
+            return None
 
-            if tag.name == 'div' and tag.get('class') == 'gs_ri':
-              if tag.a:
-                self.article['title'] = ''.join(tag.a.findAll(text=True))
-                self.article['url'] = self._path2url(tag.a['href'])
+    def put(self, url, html):
+        """
+        Stores the page fetched for the given URL.
+        """
+        fname = self._fname(url)
+        fd, tmpname = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(html)
+        with self._lock:
+            if os.path.exists(fname):
+                self._size -= os.path.getsize(fname)
+            os.rename(tmpname, fname)
+            self._size += len(html)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until we're 10% below the cap:
+        entries = sorted([(os.path.getatime(fname), fname) for fname in self._entries()])
+        for _, fname in entries:
+            if self._size <= self.max_size * 0.9:
+                break
+            try:
+                self._size -= os.path.getsize(fname)
+                os.remove(fname)
+            except OSError:
+                pass
+
+    def _ttl(self, url):
+        kind = self.endpoint(url)
+        return self.ttls.get(kind, self.ttls['default'])
+
+    def _fname(self, url):
+        key = hashlib.sha1(self.normalize(url)).hexdigest()
+        return os.path.join(self.path, key + '.html')
+
+    def _entries(self):
+        return [os.path.join(self.path, name) for name in os.listdir(self.path)
+                if name.endswith('.html')]
+
+class KeepAliveHandler(urllib2.HTTPHandler):
+    """
+    An HTTP handler that keeps its HTTP/1.1 connections open after a
+    response, and reuses them for later requests to the same host.
+    gzip-encoded responses are decoded transparently; the responses'
+    wire_length is the size of the body as received.
+    """
+    def __init__(self, max_idle=8):
+        urllib2.HTTPHandler.__init__(self)
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def http_open(self, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(req.headers)
+        headers['Connection'] = 'keep-alive'
+        headers = dict([(name.title(), val) for name, val in headers.items()])
+
+        conn, reused = self._get_conn(host, req.timeout)
+        try:
+            resp = self._request(conn, req, headers)
+        except (httplib.HTTPException, socket.error), err:
+            conn.close()
+            if not reused:
+                raise urllib2.URLError(err)
+            # The server may have closed the idle connection meanwhile,
+            # so try once more on a fresh one:
+            conn = httplib.HTTPConnection(host, timeout=req.timeout)
+            try:
+                resp = self._request(conn, req, headers)
+            except (httplib.HTTPException, socket.error), err:
+                conn.close()
+                raise urllib2.URLError(err)
+
+        try:
+            body = resp.read()
+        except (httplib.HTTPException, socket.error), err:
+            conn.close()
+            raise urllib2.URLError(err)
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._put_conn(host, conn)
+
+        wire_length = len(body)
+        if resp.getheader('content-encoding', '').lower() == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+        res = urllib.addinfourl(StringIO(body), resp.msg, req.get_full_url())
+        res.code = resp.status
+        res.msg = resp.reason
+        res.wire_length = wire_length
+        return res
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _request(self, conn, req, headers):
+        conn.request(req.get_method(), req.get_selector(), req.data, headers)
+        return conn.getresponse()
+
+    def _get_conn(self, host, timeout):
+        with self._lock:
+            conns = self._idle.get(host)
+            conn = conns.pop() if conns else None
+        if conn is None:
+            return httplib.HTTPConnection(host, timeout=timeout), False
+        if conn.sock is not None and timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _put_conn(self, host, conn):
+        with self._lock:
+            conns = self._idle.setdefault(host, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+class ScholarSession(object):
+    """
+    The HTTP state that ScholarQuerier instances share: a cookie jar,
+    and an opener that keeps its connections to Scholar alive between
+    requests and asks for gzip-compressed responses.  When given a
+    cookie file, the session loads its cookies from there, and save()
+    writes them back.  Identical work in progress on several threads
+    runs only once, see single_flight().  By default, all queriers
+    share one session per process, see shared().
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cookie_file=None):
+        self.cookie_file = cookie_file
+        # The results page layout detected last, see ScholarParser:
+        self.layout = None
+        from cookielib import LWPCookieJar
+        self.cjar = LWPCookieJar(cookie_file)
+        if cookie_file and os.path.exists(cookie_file):
+            self.cjar.load(ignore_discard=True)
+        self.handler = KeepAliveHandler()
+        self.opener = urllib2.build_opener(self.handler,
+                                           urllib2.HTTPCookieProcessor(self.cjar))
+        self.opener.addheaders = [('Accept-Encoding', 'gzip')]
+        # Futures of the calls in progress, see single_flight():
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns the process-wide session, creating it if needed.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def single_flight(self, key, func):
+        """
+        Calls func() and returns its result, unless a call for the same
+        key is already in progress.  In that case it waits for that
+        call instead and returns its result, or raises its exception.
+        Returns (result, shared), where shared tells which case it was.
+        """
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = ScholarFuture()
+        if not leader:
+            return future.result(), True
+
+        try:
+            future.set_result(func())
+        except:
+            future.set_exception(sys.exc_info())
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+        return future.result(), False
+
+    def save(self):
+        """
+        Writes the session's cookies to its cookie file, if it has one.
+        """
+        if self.cookie_file:
+            self.cjar.save(ignore_discard=True)
+
+    def close(self):
+        """
+        Closes the session's idle connections.
+        """
+        self.handler.close_all()
+
+class ScholarStats(object):
+    """
+    Counters and timings of the work that ScholarQuerier instances do.
+    The timed phases are waiting for the rate limiter or a backoff
+    before a request, opening the request and reading its response,
+    building a page's parse tree ('soup') and extracting the articles
+    from it ('extract').  The counters track bytes received, before any
+    gzip decoding, cache hits, failed requests, requests saved by
+    joining an identical one in progress, and articles parsed and
+    dropped, as those without a title.  Instances are thread-safe, so
+    several queriers can share one.
+    """
+    PHASES = ('wait', 'open', 'read', 'soup', 'extract')
+    COUNTERS = ('bytes', 'cache_hits', 'errors', 'saved_requests', 'articles', 'dropped')
+
+    def __init__(self):
+        self.timings = dict([(phase, []) for phase in self.PHASES])
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def count(self, counter, num=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + num
+
+    def time(self, phase, secs):
+        with self._lock:
+            self.timings.setdefault(phase, []).append(secs)
+
+    @contextlib.contextmanager
+    def timing(self, phase):
+        """
+        Context manager that records the time spent in its block as
+        one occurrence of the given phase.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.time(phase, time.time() - start)
 
-              if tag.find('div', {'class': 'gs_a'}):
-                year = self.year_re.findall(tag.find('div', {'class': 'gs_a'}).text)
-                self.article['year'] = year[0] if len(year) > 0 else None
+    def as_dict(self):
+        """
+        Returns the counters, and for every phase the number of
+        occurrences and the total, mean, median, 90th percentile and
+        maximum of their durations in seconds.
+        """
+        with self._lock:
+            timings = dict([(phase, sorted(times)) for phase, times in self.timings.items()])
+            res = {'counters': dict(self.counters), 'timings': {}}
+        for phase, times in timings.items():
+            num = len(times)
+            res['timings'][phase] = {
+                'count': num,
+                'total': sum(times),
+                'mean': sum(times) / num if num else 0.0,
+                'p50': times[num // 2] if num else 0.0,
+                'p90': times[min(num - 1, int(num * 0.9))] if num else 0.0,
+                'max': times[-1] if num else 0.0}
+        return res
+
+    def summary(self):
+        """
+        Returns a human-readable summary of the statistics.
+        """
+        stats = self.as_dict()
+        lines = ['%-8s %6s %10s %10s %10s %10s %10s' %
+                 ('phase', 'count', 'total ms', 'mean ms', 'p50 ms', 'p90 ms', 'max ms')]
+        for phase in self.PHASES:
+            tim = stats['timings'][phase]
+            lines.append('%-8s %6d %10.1f %10.2f %10.2f %10.2f %10.2f' %
+                         (phase, tim['count'], tim['total'] * 1000, tim['mean'] * 1000,
+                          tim['p50'] * 1000, tim['p90'] * 1000, tim['max'] * 1000))
+        lines.append(', '.join(['%s %d' % (counter, stats['counters'][counter])
+                                for counter in self.COUNTERS]))
+        return '\n'.join(lines)
+
+class ScholarStore(object):
+    """
+    A persistent SQLite store of articles, so that results accumulated
+    over many queries can be searched without touching the network.
+    Articles are deduplicated on their Scholar cluster ID, as found in
+    their versions or citations list URLs, or else on their normalized
+    title.  Storing a known article again merges the new fields into
+    the stored ones.  Added articles get written in batches of
+    batch_size, each in a single transaction; flush() or close() writes
+    the rest.  Instances are thread-safe.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS articles (
+            key           TEXT PRIMARY KEY,
+            title         TEXT,
+            title_norm    TEXT,
+            authors       TEXT,
+            url           TEXT,
+            num_citations INTEGER,
+            num_versions  INTEGER,
+            url_citations TEXT,
+            url_versions  TEXT,
+            year          TEXT,
+            journal       TEXT,
+            extras        TEXT,
+            updated       REAL);
+        CREATE TABLE IF NOT EXISTS authors (
+            key           TEXT,
+            name          TEXT,
+            surname       TEXT,
+            PRIMARY KEY (key, name));
+        CREATE INDEX IF NOT EXISTS articles_title ON articles (title_norm);
+        CREATE INDEX IF NOT EXISTS articles_year ON articles (year);
+        CREATE INDEX IF NOT EXISTS authors_name ON authors (name);
+        CREATE INDEX IF NOT EXISTS authors_surname ON authors (surname);
+        """
+
+    # The article columns that correspond to Article fields:
+    COLUMNS = Article.KEYS
+
+    INSERT = 'INSERT OR IGNORE INTO articles (key, title_norm, extras, updated, %s) ' \
+        'VALUES (?, ?, ?, ?, %s)' % (', '.join(COLUMNS), ', '.join(['?'] * len(COLUMNS)))
+
+    # Known articles keep what a new copy lacks. Citation and version
+    # counts only grow, and a zero means Scholar showed no link. The
+    # extras come already merged with the stored ones, see _upsert():
+    UPDATE = 'UPDATE articles SET title_norm = COALESCE(?, title_norm), ' \
+        'extras = COALESCE(?, extras), updated = ?, ' + \
+        ', '.join([('%s = MAX(?, %s)' if col.startswith('num_') else '%s = COALESCE(?, %s)')
+                   % (col, col) for col in COLUMNS]) + ' WHERE key = ?'
+
+    CLUSTER_RE = re.compile(r'[?&](?:cluster|cites)=(\d+)')
+
+    def __init__(self, path, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.RLock()
+        import sqlite3
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(self.SCHEMA)
+
+    @classmethod
+    def article_key(cls, art):
+        """
+        Returns the key that identifies the article in the store: its
+        cluster ID, or else its normalized title.
+        """
+        for url in (art['url_versions'], art['url_citations']):
+            match = cls.CLUSTER_RE.search(url or '')
+            if match:
+                return 'cluster:' + match.group(1)
+        return 'title:' + _normalize_title(art['title'] or '')
+
+    def add(self, art):
+        """
+        Queues the article for storing.
+        """
+        with self._lock:
+            self._pending.append(art)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def add_many(self, articles):
+        for art in articles:
+            self.add(art)
+
+    def flush(self):
+        """
+        Writes the queued articles in a single transaction.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+            now = time.time()
+            with self.conn:
+                for art in pending:
+                    self._upsert(art, now)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.conn.close()
+
+    def __len__(self):
+        with self._lock:
+            self.flush()
+            return self.conn.execute('SELECT COUNT(*) FROM articles').fetchone()[0]
+
+    def find(self, title=None, author=None, year=None, words=None, limit=0):
+        """
+        Returns the stored articles that match all of the given criteria,
+        most cited first, up to limit articles (0 means no limit).  The
+        title must match after normalization, the author one of the
+        article's authors by full name or surname, regardless of case.
+        The year may be a single year or a (first, last) range.  Words
+        is a string whose words must all occur in the title.
+        """
+        sql = ['SELECT * FROM articles']
+        where, args = [], []
+        if title:
+            where.append('title_norm = ?')
+            args.append(_normalize_title(title))
+        if author:
+            name = ' '.join(author.lower().split())
+            where.append('key IN (SELECT key FROM authors WHERE name = ? '
+                         'UNION SELECT key FROM authors WHERE surname = ?)')
+            args.extend([name, name])
+        if isinstance(year, (tuple, list)):
+            where.append('year BETWEEN ? AND ?')
+            args.extend([unicode(year[0]), unicode(year[1])])
+        elif year:
+            where.append('year = ?')
+            args.append(unicode(year))
+        for word in _normalize_title(words or '').split():
+            where.append("(' ' || title_norm || ' ') LIKE ?")
+            args.append('% ' + word + ' %')
+        if where:
+            sql.append('WHERE ' + ' AND '.join(where))
+        sql.append('ORDER BY num_citations DESC')
+        if limit:
+            sql.append('LIMIT %d' % limit)
+
+        with self._lock:
+            self.flush()
+            cur = self.conn.execute(' '.join(sql), args)
+            names = [desc[0] for desc in cur.description]
+            rows = cur.fetchall()
+        return [self._make_article(dict(zip(names, row))) for row in rows]
+
+    def _upsert(self, art, now):
+        key = self.article_key(art)
+        values = [self._as_column(col, art[col]) for col in self.COLUMNS]
+        title_norm = _normalize_title(art['title']) if art['title'] else None
+        extras = None
+        if art._extras:
+            extras = json.dumps(art._extras)
+
+        cur = self.conn.execute(self.INSERT, [key, title_norm, extras, now] + values)
+        if cur.rowcount == 0:
+            if extras is not None:
+                row = self.conn.execute('SELECT extras FROM articles WHERE key = ?',
+                                        (key,)).fetchone()
+                if row[0]:
+                    merged = json.loads(row[0])
+                    merged.update([(name, val) for name, val in art._extras.items()
+                                   if val is not None])
+                    extras = json.dumps(merged)
+            self.conn.execute(self.UPDATE, [title_norm, extras, now] + values + [key])
+
+        if art['authors']:
+            names = [' '.join(name.lower().split()) for name in art['authors'].split(',')]
+            self.conn.executemany('INSERT OR IGNORE INTO authors VALUES (?, ?, ?)',
+                                  [(key, name, name.split()[-1]) for name in names
+                                   if name and name not in (u'...', u'\u2026')])
+
+    def _as_column(self, col, val):
+        if col.startswith('num_'):
+            return val or 0
+        # BeautifulSoup's strings subclass unicode, which sqlite3
+        # doesn't bind:
+        if isinstance(val, basestring):
+            return unicode(val) if val != '' else None
+        return val
+
+    def _make_article(self, row):
+        art = Article()
+        for col in self.COLUMNS:
+            if row[col] is not None:
+                setattr(art, col, row[col])
+        if row['extras']:
+            for key, val in json.loads(row['extras']).items():
+                art[key] = val
+        return art
+
+class ScholarMetrics(object):
+    """
+    Bibliometrics over the articles of many author profiles at once.
+    Articles get added per profile and are kept as column arrays of
+    their citation counts, years and profile numbers, so that compute()
+    handles all profiles in one pass over the columns.  It uses NumPy
+    if installed, unless use_numpy is False, and plain Python otherwise;
+    both give the same results.
+    """
+    # Percentiles of the citations per article, by nearest rank:
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, use_numpy=None):
+        self.use_numpy = use_numpy
+        self.names = []
+        self.citations = array.array('l')
+        self.years = array.array('l')
+        self.profiles = array.array('l')
+
+    def add(self, name, articles):
+        """
+        Adds a profile under the given name, with its articles.
+        """
+        profile = len(self.names)
+        self.names.append(name)
+        for art in articles:
+            self.citations.append(art['num_citations'] or 0)
+            try:
+                self.years.append(int(art['year']))
+            except (TypeError, ValueError):
+                self.years.append(0)
+            self.profiles.append(profile)
+
+    def compute(self):
+        """
+        Returns a list with a dict of metrics per profile, in the order
+        added: the number of articles and their citations, the h-index
+        and i10-index, the citations of articles by year of
+        publication, and the PERCENTILES of citations per article.
+        """
+        numpy = None
+        if self.use_numpy is not False and self.citations:
+            try:
+                import numpy
+            except ImportError:
+                if self.use_numpy:
+                    raise
+        if numpy is not None:
+            columns = self._compute_numpy(numpy)
+        else:
+            columns = self._compute_python()
 
-              if tag.find('div', {'class': 'gs_fl'}):
-                self._parse_links(tag.find('div', {'class': 'gs_fl'}))
+        res = []
+        for idx, name in enumerate(self.names):
+            res.append(OrderedDict([
+                ('author', name),
+                ('articles', columns['articles'][idx]),
+                ('citations', columns['citations'][idx]),
+                ('h_index', columns['h_index'][idx]),
+                ('i10_index', columns['i10_index'][idx]),
+                ('citations_per_year', columns['per_year'][idx]),
+                ('percentiles', OrderedDict([('p%d' % pct, columns[pct][idx])
+                                             for pct in self.PERCENTILES]))]))
+        return res
+
+    def _percentile_rank(self, num, pct):
+        # Position of the percentile within num ascending values:
+        return min(num - 1, num * pct // 100)
+
+    def _compute_python(self):
+        num = len(self.names)
+        rows = [[] for _ in range(num)]
+        for cit, year, profile in itertools.izip(self.citations, self.years, self.profiles):
+            rows[profile].append((cit, year))
+
+        columns = dict([(key, []) for key in ('articles', 'citations', 'h_index', 'i10_index',
+                                              'per_year') + self.PERCENTILES])
+        for profile in rows:
+            cits = sorted([cit for cit, year in profile])
+            num_cits = len(cits)
+            columns['articles'].append(num_cits)
+            columns['citations'].append(sum(cits))
+            columns['h_index'].append(len([1 for rank, cit in enumerate(reversed(cits))
+                                           if cit >= rank + 1]))
+            columns['i10_index'].append(len([1 for cit in cits if cit >= 10]))
+            per_year = collections.defaultdict(int)
+            for cit, year in profile:
+                if year:
+                    per_year[year] += cit
+            columns['per_year'].append(dict(per_year))
+            for pct in self.PERCENTILES:
+                columns[pct].append(cits[self._percentile_rank(num_cits, pct)]
+                                    if num_cits else None)
+        return columns
+
+    def _compute_numpy(self, numpy):
+        num = len(self.names)
+        cits = numpy.frombuffer(self.citations, dtype='l')
+        years = numpy.frombuffer(self.years, dtype='l')
+        profiles = numpy.frombuffer(self.profiles, dtype='l')
+
+        counts = numpy.bincount(profiles, minlength=num)
+        columns = {'articles': counts.tolist(),
+                   'citations': numpy.bincount(profiles, weights=cits,
+                                               minlength=num).astype('l').tolist(),
+                   'i10_index': numpy.bincount(profiles, weights=cits >= 10,
+                                               minlength=num).astype('l').tolist()}
+
+        # Sort by profile, and by descending citations within profiles:
+        top = cits.max() + 1
+        order = numpy.argsort(profiles * top + (top - 1 - cits))
+        sorted_cits = cits[order]
+        sorted_profiles = profiles[order]
+        starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        ranks = numpy.arange(len(cits)) - starts[sorted_profiles] + 1
+        columns['h_index'] = numpy.bincount(sorted_profiles, weights=sorted_cits >= ranks,
+                                            minlength=num).astype('l').tolist()
+
+        for pct in self.PERCENTILES:
+            idx = starts + counts - 1 - numpy.minimum(counts - 1, counts * pct // 100)
+            vals = sorted_cits[numpy.clip(idx, 0, len(cits) - 1)].tolist()
+            columns[pct] = [val if count else None for val, count in zip(vals, counts)]
+
+        columns['per_year'] = [{} for _ in range(num)]
+        dated = years > 0
+        keys, inverse = numpy.unique(profiles[dated] * 10000 + years[dated],
+                                     return_inverse=True)
+        sums = numpy.bincount(inverse, weights=cits[dated]).astype('l')
+        for key, total in zip(keys.tolist(), sums.tolist()):
+            columns['per_year'][key // 10000][key % 10000] = total
+        return columns
+
+class ScholarSink(object):
+    """
+    Base class of the output sinks, which write streams of articles to
+    a file, or to stdout by default.  Written articles are buffered and
+    get formatted and written in batches of batch_size, or once
+    flush_interval seconds have passed since the last batch, so that
+    slow queries still show progress.  close() writes the rest, and
+    closes the output unless it was given as a file object.
+    """
+    def __init__(self, output=None, batch_size=1000, flush_interval=1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._flushed = time.time()
+        self._close_out = isinstance(output, basestring)
+        if output is None:
+            self.out = sys.stdout
+        elif self._close_out:
+            self.out = self._open(output)
+        else:
+            self.out = output
+
+    def write(self, art):
+        self._buffer.append(art)
+        if len(self._buffer) >= self.batch_size or \
+                time.time() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def write_many(self, articles):
+        for art in articles:
+            self.write(art)
+
+    def flush(self):
+        articles, self._buffer = self._buffer, []
+        if articles:
+            self._write_batch(articles)
+            self.out.flush()
+        self._flushed = time.time()
+
+    def close(self):
+        self.flush()
+        if self._close_out:
+            self.out.close()
+
+    def _open(self, output):
+        return open(output, 'wb')
+
+    def _write_batch(self, articles):
+        """
+        Writes the given articles.  In this base class, it does nothing.
+        """
 
-        if self.article['title']:
-            self.handle_article(self.article)
+class TxtSink(ScholarSink):
+    """
+    Writes articles in the text format, as UTF-8.
+    """
+    def _write_batch(self, articles):
+        self.out.write(''.join([art.as_txt().encode('utf-8') + '\n\n' for art in articles]))
 
+class JsonLinesSink(ScholarSink):
+    """
+    Writes articles as JSON objects, one per line.  Unlike with
+    Article.as_dict(), their keys come in no particular order.
+    """
+    def _write_batch(self, articles):
+        self.out.write(''.join([json.dumps(dict(zip(art.keys(), art.values())))
+                                + '\n' for art in articles]))
+
+class CsvSink(ScholarSink):
+    """
+    Writes articles as RFC 4180 CSV in UTF-8, with a header line of the
+    first article's keys unless header is False.  Fields are quoted as
+    needed, and missing values are left empty.
+    """
+    DELIMITER = ','
+
+    def __init__(self, output=None, header=True, **kwargs):
+        ScholarSink.__init__(self, output, **kwargs)
+        import csv as csv_module
+        self.writer = csv_module.writer(self.out, delimiter=self.DELIMITER,
+                                        lineterminator='\r\n')
+        self.header = header
+
+    def _write_batch(self, articles):
+        if self.header:
+            self.writer.writerow(articles[0].keys())
+            self.header = False
+        self.writer.writerows([[val.encode('utf-8') if isinstance(val, unicode)
+                                else '' if val is None else val
+                                for val in art.values()]
+                               for art in articles])
+
+class TsvSink(CsvSink):
+    """
+    Like CsvSink, with tabs separating the fields.
+    """
+    DELIMITER = '\t'
+
+class StoreSink(ScholarSink):
+    """
+    Writes articles into a ScholarStore, given as one or as the path of
+    its database, in transactions of batch_size articles.
+    """
+    def _open(self, output):
+        return ScholarStore(output, batch_size=self.batch_size)
+
+    def _write_batch(self, articles):
+        self.out.add_many(articles)
 
 class ScholarQuerier():
     """
     ScholarQuerier instances can conduct a search on Google Scholar
     with subsequent parsing of the resulting HTML content.  The
     articles found are collected in the articles member, a list of
-    Article instances.
+    Article instances.  Requests go through a ScholarSession, by
+    default the one shared by all queriers in the process.
     """
     SCHOLAR_URL = 'http://scholar.google.com/scholar?hl=en&q=%(query)s+author:%(author)s&btnG=Search&as_subj=eng&as_sdt=1,5&as_ylo=&as_vis=0'
     NOAUTH_URL = 'http://scholar.google.com/scholar?hl=en&q=%(query)s&btnG=Search&as_subj=eng&as_std=1,5&as_ylo=&as_vis=0'
@@ -279,19 +1598,45 @@ class ScholarQuerier():
 
     UA = 'Mozilla/5.0 (X11; U; FreeBSD i386; en-US; rv:1.9.2.9) Gecko/20100913 Firefox/3.6.9'
 
-    class Parser(ScholarParser120726):
-        def __init__(self, querier):
-            ScholarParser.__init__(self)
+    # Maximum number of concurrent citation view requests when
+    # parsing an author's citation page:
+    WORKERS = 8
+
+    # Number of results on a page when no count is given, as with
+    # Scholar's own default:
+    PAGE_SIZE = 10
+
+    # Number of works on a profile page, see AuthorParser.PAGE_SIZE:
+    PROFILE_PAGE_SIZE = 100
+
+    class Parser(ScholarParser):
+        def __init__(self, querier, handler=None):
+            ScholarParser.__init__(self, querier.site, querier.stats, querier.fields)
             self.querier = querier
+            self.handler = handler or querier.add_article
+
+        def get_layout(self):
+            return self.querier.session.layout
+
+        def set_layout(self, layout):
+            self.querier.session.layout = layout
 
         def handle_article(self, art):
-            self.querier.add_article(art)
+            self.stats.count('articles')
+            if self.querier.fields:
+                art.project(self.querier.fields)
+            self.handler(art)
+
+        def handle_dropped(self, art):
+            self.stats.count('dropped')
 
     class AuthorParser():
         """
         Parser for the author page. Version date: 5 Dec 2013
         """
         PAGE_SIZE = '&view_op=list_works&pagesize=100'
+        STRAINER = _Strainer('a', href=True)
+        MARKER = '/citations?user='
 
         def __init__(self, querier):
             self.soup = None
@@ -303,16 +1648,20 @@ class ScholarQuerier():
             This method initiates parsing of HTML content for an author page.
             It serach for a link with href = citations?user=XXXXXXXXXX=en
             """
-            self.soup = BeautifulSoup(html)
-            for link in self.soup.findAll('a'):
-                s = ScholarParser.SCHOLAR_SITE + link.get('href') + self.PAGE_SIZE
-                if self.author_url_pattern in s:
-                    return s
+            with self.querier.stats.timing('soup'):
+                self.soup = _partial_soup(html, self.STRAINER, self.MARKER)
+            with self.querier.stats.timing('extract'):
+                for link in self.soup.findAll('a'):
+                    s = self.querier.site + link.get('href') + self.PAGE_SIZE
+                    if self.author_url_pattern in s:
+                        return s
 
     class ViewCitationParser():
         """
             Parser for the view citation page. Version date: 5 Dec 2013
         """
+        STRAINER = _Strainer('td', {'class': 'cit-contentcell'})
+        MARKER = 'class="cit-contentcell"'
 
         def __init__(self, querier):
             self.soup = None
@@ -323,14 +1672,16 @@ class ScholarQuerier():
             """
             This method initiates parsing of HTML content for a citation view page.
             """
-            self.soup = BeautifulSoup(html)
-            td_content_cell = self.soup.find(self._tag_checker)
-            self.article_info['url'] = td_content_cell.find(id='title').a.get('href')
-            for link in td_content_cell.findAll('a'):
-                url = link.get('href')
-                if ('&cluster=' in url) and (not url.endswith('&btnI=Lucky')):
-                    self.article_info['url_versions'] = link.get('href')
-                    self.article_info['num_versions'] = self._as_int(link.getText().split()[1])
+            with self.querier.stats.timing('soup'):
+                self.soup = _partial_soup(html, self.STRAINER, self.MARKER)
+            with self.querier.stats.timing('extract'):
+                td_content_cell = self.soup.find(self._tag_checker)
+                self.article_info['url'] = td_content_cell.find(id='title').a.get('href')
+                for link in td_content_cell.findAll('a'):
+                    url = link.get('href')
+                    if ('&cluster=' in url) and (not url.endswith('&btnI=Lucky')):
+                        self.article_info['url_versions'] = link.get('href')
+                        self.article_info['num_versions'] = self._as_int(link.getText().split()[1])
             return self.article_info
 
         def _tag_checker(self, tag):
@@ -349,57 +1700,142 @@ class ScholarQuerier():
         Parser for the author citation page. It invokes the handle_article() callback on each article
     that was parsed successfully. Version date: 5 Dec 2013
         """
+        STRAINER = _Strainer('tr', {'class': 'cit-table item'})
+        MARKER = 'class="cit-table item"'
+
+        # The fields that only the citation view pages provide:
+        VIEW_FIELDS = ('url', 'url_versions', 'num_versions')
 
         def __init__(self, querier):
             self.soup = None
             self.querier = querier
-            self.site = ScholarParser.SCHOLAR_SITE
+            self.site = querier.site
 
         def parse(self, html):
             """
             This method initiates parsing of HTML content for an author citation page.
-            It serach for a table
+            It serach for a table, see iter_articles() for how the articles
+            get completed.  Articles are handled in the order of the table.
+            """
+            for art in self.iter_articles(html):
+                self.handle_article(art)
+
+        def iter_articles(self, html, limit=0):
             """
-            self.soup = BeautifulSoup(html)
-            for tr in self.soup.findAll(self._tag_checker):
-                self._parse_article(tr)
+            Generator that yields the articles in an author citation page, in
+            the order of the table and up to limit articles (0 means no limit).
+            Every article gets completed by its citation view page, see
+            iter_completed().
+            """
+            rows = self.parse_rows(html)
+            if limit:
+                rows = rows[:limit]
+            for article, complete in self.iter_completed(rows):
+                yield article
+
+        def parse_rows(self, html):
+            """
+            Parses only the table of an author citation page, and returns
+            a list of (article, citation view url) pairs.  The articles
+            lack the information found on the citation view pages.
+            """
+            stats = self.querier.stats
+            with stats.timing('soup'):
+                self.soup = _partial_soup(html, self.STRAINER, self.MARKER)
+            with stats.timing('extract'):
+                rows = []
+                for tr in self.soup.findAll(self._tag_checker):
+                    article, url = self._parse_article(tr)
+                    if article['title']:
+                        rows.append((article, url))
+                    else:
+                        self.handle_dropped(article)
+            return rows
+
+        def iter_completed(self, rows):
+            """
+            Generator that completes the articles of the given rows, as
+            returned by parse_rows(), with their citation view pages.
+            These get fetched by at most querier.workers concurrent
+            requests, a bounded number of rows ahead of the article last
+            yielded.  Yields (article, complete) pairs in the order of the
+            rows; complete is False when the querier's deadline prevented
+            fetching the citation view.  Unless the querier wants any of
+            VIEW_FIELDS, no citation views get fetched.
+            """
+            fields = self.querier.fields
+            if fields and not set(fields).intersection(self.VIEW_FIELDS):
+                for article, url in rows:
+                    article.project(fields)
+                    self.querier.stats.count('articles')
+                    yield article, True
+                return
+
+            rows = iter(rows)
+            window = 2 * self.querier.workers
+            pending = collections.deque()
+            pool = ScholarWorkerPool(self.querier.workers)
+            try:
+                for article, url in itertools.islice(rows, window):
+                    pending.append((article, pool.submit(self.querier.query_citation_view, url)))
+                while pending:
+                    article, view = pending.popleft()
+                    for next_article, url in itertools.islice(rows, 1):
+                        pending.append((next_article,
+                                        pool.submit(self.querier.query_citation_view, url)))
+                    complete = True
+                    try:
+                        self._add_view_info(article, view.result())
+                    except ScholarDeadlineExceeded:
+                        # Keep what the table row told us:
+                        self.querier.partial = True
+                        complete = False
+                    if fields:
+                        article.project(fields)
+                    self.querier.stats.count('articles')
+                    yield article, complete
+            finally:
+                pool.shutdown(cancel=True)
 
         def handle_article(self, art):
             self.querier.add_article(art)
 
+        def handle_dropped(self, art):
+            self.querier.stats.count('dropped')
+
         def _parse_article(self, tr):
-            self.article  = Article()
+            """
+            Parses the fields available in the table row and returns
+            the article along with the url of its citation view page.
+            """
+            article       = Article()
             tag_article   = tr.find(id='col-title')
             tag_citations = tr.find(id='col-citedby')
             tag_year      = tr.find(id='col-year')
 
-            self.article['title'] = tag_article.a.getText()
-            # get the url for the citation view page I reclycle the ScholarQuery class ...
+            article['title'] = tag_article.a.getText()
             url = self._path2url(tag_article.a.get('href'))
-            querier = ScholarQuerier(self)
-            article_info = querier.query_citation_view(url)
-
-            if article_info.has_key('url'):
-                self.article['url'] = article_info['url']
-
-            if article_info.has_key('url_versions'):
-                self.article['num_versions'] = article_info['num_versions']
-                self.article['url_versions'] = article_info['url_versions']
 
             spans = tag_article.findAll('span')
             if (len(spans) > 0):
-                self.article['authors']       = spans[0].getText()
+                article['authors']       = spans[0].getText()
                 if (len(spans) > 1):
-                    self.article['journal']       = spans[1].getText()
+                    article['journal']       = spans[1].getText()
 
             if tag_citations.getText() != "":
-                self.article['num_citations'] = self._as_int(tag_citations.a.getText())
-                self.article['url_citations'] = self._path2url(tag_citations.a.get('href'))
+                article['num_citations'] = self._as_int(tag_citations.a.getText())
+                article['url_citations'] = self._path2url(tag_citations.a.get('href'))
 
-            self.article['year']          = tag_year.getText()
+            article['year']          = tag_year.getText()
+            return article, url
 
-            if self.article['title']:
-                self.handle_article(self.article)
+        def _add_view_info(self, article, article_info):
+            if article_info.has_key('url'):
+                article['url'] = article_info['url']
+
+            if article_info.has_key('url_versions'):
+                article['num_versions'] = article_info['num_versions']
+                article['url_versions'] = article_info['url_versions']
 
         def _tag_checker(self, tag):
             if tag.name == 'tr' and tag.get('class') == 'cit-table item':
@@ -419,10 +1855,29 @@ class ScholarQuerier():
                 path = '/' + path
             return self.site + path
 
-    def __init__(self, author='', scholar_url=None, count=0, search_author=False):
+    # Markers telling the kinds of pages apart, checked in order:
+    PAGE_TYPES = (('profile',        CitationParser.MARKER),
+                  ('citation_view',  ViewCitationParser.MARKER),
+                  ('results',        ScholarParser.MARKER),
+                  ('author_search',  AuthorParser.MARKER))
+
+    def __init__(self, author='', scholar_url=None, count=0, search_author=False,
+                 workers=None, cache=None, rate_limiter=None, session=None,
+                 scheduler=None, site=None, stats=None, fields=None, max_works=0):
         self.articles = []
         self.author = author
         self.search_author = search_author
+        self.workers = workers or self.WORKERS
+        self.cache = cache
+        self.scheduler = scheduler or ScholarScheduler(limiter=rate_limiter)
+        self.stats = stats or ScholarStats()
+        # The Article fields wanted, in rendering order, or None for
+        # all of them. Others may be left out, and go unrendered:
+        self.fields = tuple(fields) if fields else None
+        # Maximum number of works to take from a profile, 0 for all:
+        self.max_works = max_works
+        # Whether the scheduler's deadline cut the last query short:
+        self.partial = False
 
         # Clip to 100, as Google doesn't support more anyway
         self.count = min(count, 100)
@@ -437,8 +1892,13 @@ class ScholarQuerier():
         if self.count != 0:
             self.scholar_url += '&num=%d' % self.count
 
-        self.cjar = CookieJar()
-        self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cjar))
+        # Allow talking to a stand-in for Scholar, such as a test server:
+        self.site = site or ScholarParser.SCHOLAR_SITE
+        self.scholar_url = self.scholar_url.replace(ScholarParser.SCHOLAR_SITE, self.site, 1)
+
+        self.session = session or ScholarSession.shared()
+        self.cjar = self.session.cjar
+        self.opener = self.session.opener
 
     def query(self, search):
         """
@@ -446,29 +1906,199 @@ class ScholarQuerier():
         response.
         """
         self.clear_articles()
-        url = self.scholar_url % {'query': urllib.quote(search.encode('utf-8')), 'author': urllib.quote(self.author)}
-        req = urllib2.Request(url=url,
-                              headers={'User-Agent': self.UA})
-        hdl = self.opener.open(req)
-        html = hdl.read()
-        self.parse(html)
+        try:
+            html = self._fetch(self._query_url(search))
+            self.parse(html)
+        except ScholarDeadlineExceeded:
+            self.partial = True
+
+    def iter_articles(self, search, limit=0):
+        """
+        This method pages through the results of a query, yielding
+        Article instances as each results page gets parsed, up to limit
+        articles (0 means no limit).  The next page is fetched while the
+        current one is being parsed.  Yielded articles are not added to
+        the articles member.
+        """
+        return self._iter_results(lambda start: self._query_url(search, start), limit)
+
+    def iter_citations(self, url, limit=0):
+        """
+        This method pages through the articles citing an article, given
+        its url_citations, like iter_articles() does for a query.
+        """
+        if self.count:
+            url += '&num=%d' % self.count
+        return self._iter_results(lambda start: url + ('&start=%d' % start if start else ''),
+                                  limit)
+
+    def _iter_results(self, page_url, limit):
+        """
+        Generator behind iter_articles() and iter_citations(), which
+        yields the articles on the results pages at page_url(start).
+        """
+        page_size = self.count or self.PAGE_SIZE
+
+        def urls():
+            start = 0
+            while not limit or start < limit:
+                yield page_url(start)
+                start += page_size
+
+        self.partial = False
+        pages = self._iter_pages(urls(), self._parse_results)
+        num_articles = 0
+        try:
+            for articles in pages:
+                if not articles:
+                    return
+                for art in articles:
+                    yield art
+                    num_articles += 1
+                    if limit and num_articles >= limit:
+                        return
+        except ScholarDeadlineExceeded:
+            self.partial = True
+        finally:
+            pages.close()
 
     def query_author(self, search):
         """
         This method initiates a query using the search author google scholar query
         """
         self.clear_articles()
+        for art in self.iter_author_articles(search):
+            self.add_article(art)
+
+    def iter_author_articles(self, search, limit=0):
+        """
+        This method yields the articles of the author's profile, in the
+        profile's order and as soon as each is complete, up to limit
+        articles (0 means no limit) or max_works.  The profile's pages
+        get fetched as the articles are needed, see _iter_profile_rows().
+        Citation view pages beyond the limit are never fetched.  Yielded
+        articles are not added to the articles member.
+        """
+        self.partial = False
+        try:
+            parser = self.CitationParser(self)
+            for art, complete in parser.iter_completed(self._iter_profile_rows(limit)):
+                yield art
+        except ScholarDeadlineExceeded:
+            self.partial = True
+
+    # The fields of an author's profile table that sync_author()
+    # compares against its snapshot:
+    SYNC_FIELDS = ('title', 'num_citations', 'year')
+
+    def sync_author(self, search, snapshot):
+        """
+        This method brings a local snapshot of the author's profile up to
+        date, and returns the changes as a list of (change, article)
+        pairs, where change is 'new', 'changed' or 'removed'.  The
+        snapshot is a JSON file of the profile's articles keyed by their
+        citation view urls.  Only the profile table is fetched in full;
+        citation view pages get fetched just for rows that are new or
+        differ from the snapshot in any of SYNC_FIELDS.
+        """
+        self.clear_articles()
+        known = {}
+        if os.path.exists(snapshot):
+            with open(snapshot) as fh:
+                known = json.load(fh)['articles']
+
+        # Without all of the profile, we cannot tell what got removed,
+        # so max_works does not apply here:
+        try:
+            rows = list(self._iter_profile_rows(all_works=True))
+        except ScholarDeadlineExceeded:
+            self.partial = True
+            return []
+
+        parser = self.CitationParser(self)
+        changes = {}
+        for article, url in rows:
+            if url not in known:
+                changes[url] = 'new'
+            elif [article[key] for key in self.SYNC_FIELDS] != \
+                    [known[url].get(key) for key in self.SYNC_FIELDS]:
+                changes[url] = 'changed'
+
+        updated = dict([(url, known[url]) for article, url in rows if url in known])
+        changed_rows = [row for row in rows if row[1] in changes]
+        res = []
+        for (_, url), (article, complete) in zip(changed_rows,
+                                                 parser.iter_completed(changed_rows)):
+            # Incomplete articles don't go into the snapshot, so that
+            # the next sync fetches them again:
+            if complete:
+                updated[url] = article.as_dict()
+            res.append((changes[url], article))
+
+        for url, info in known.items():
+            if url not in updated and url not in changes:
+                article = Article()
+                for key, val in info.items():
+                    article[key] = val
+                res.append(('removed', article))
+
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(snapshot)))
+        with os.fdopen(fd, 'w') as fh:
+            json.dump({'author': self.author, 'articles': updated}, fh)
+        os.rename(tmpname, snapshot)
+        return res
+
+    def _profile_url(self):
+        """
+        Fetches the author page, and returns the url of the author's
+        citation page found there.
+        """
         url = self.scholar_url % {'author' : urllib.quote(self.author)}
-        req = urllib2.Request(url=url,
-                              headers={'User-Agent': self.UA})
-        hdl = self.opener.open(req)
-        html = hdl.read()
-        author_url = self.parse_author_page(html)
-        req = urllib2.Request(url=author_url,
-                              headers={'User-Agent': self.UA})
-        hdl = self.opener.open(req)
-        html = hdl.read()
-        self.parse_citation_page(html)
+        html = self._fetch(url)
+        return self.parse_author_page(html)
+
+    def _iter_profile_rows(self, limit=0, all_works=False):
+        """
+        Generator that yields the (article, citation view url) rows of
+        the author's citation page, see CitationParser.parse_rows(), up
+        to limit rows or max_works, whichever is lower (0 means no
+        limit).  With all_works, max_works does not apply.  A profile
+        is split into pages of PROFILE_PAGE_SIZE works.  The first page
+        is fetched on its own.  If that page is full, the further pages
+        follow via their cstart offsets, each fetched while the
+        previous one is being parsed.
+        """
+        max_works = 0 if all_works else self.max_works
+        limit = min([num for num in (limit, max_works) if num] or [0])
+        profile_url = self._profile_url()
+        page_size = self.PROFILE_PAGE_SIZE
+        parser = self.CitationParser(self)
+
+        def urls():
+            start = page_size
+            while not limit or start < limit:
+                yield profile_url + '&cstart=%d' % start
+                start += page_size
+
+        rows = parser.parse_rows(self._fetch(profile_url))
+        more = None
+        if len(rows) >= page_size and (not limit or limit > page_size):
+            more = self._iter_pages(urls(), parser.parse_rows)
+        pages = itertools.chain([rows], more or [])
+
+        num_rows = 0
+        try:
+            for rows in pages:
+                for row in rows:
+                    yield row
+                    num_rows += 1
+                    if limit and num_rows >= limit:
+                        return
+                if len(rows) < page_size:
+                    return
+        finally:
+            if more is not None:
+                more.close()
 
     def parse(self, html):
         """
@@ -477,6 +2107,71 @@ class ScholarQuerier():
         parser = self.Parser(self)
         parser.parse(html)
 
+    def _query_url(self, search, start=0):
+        url = self.scholar_url % {'query': urllib.quote(search.encode('utf-8')), 'author': urllib.quote(self.author)}
+        if start:
+            url += '&start=%d' % start
+        return url
+
+    def _parse_results(self, html):
+        """
+        Parses a results page and returns its articles as a list.
+        """
+        articles = []
+        parser = self.Parser(self, articles.append)
+        parser.parse(html)
+        return articles
+
+    def _iter_pages(self, urls, parse_page):
+        """
+        Generator that fetches the pages at the given urls in turn and
+        yields parse_page(html) for each of them.  While a page is being
+        parsed, the next one is already being fetched.
+        """
+        pool = ScholarWorkerPool(1)
+        try:
+            urls = iter(urls)
+            try:
+                pending = pool.submit(self._fetch, urls.next())
+            except StopIteration:
+                return
+            for url in urls:
+                html = pending.result()
+                pending = pool.submit(self._fetch, url)
+                yield parse_page(html)
+            yield parse_page(pending.result())
+        finally:
+            pool.shutdown()
+
+    def parse_page(self, html):
+        """
+        This method parses a saved page of any of the kinds that
+        ScholarQuerier fetches, without fetching anything else.  It
+        returns the kind of page along with what the page holds: a list
+        of articles for 'results' and 'profile' pages, the profile url
+        for 'author_search' pages, and a dict of article information
+        for 'citation_view' pages.  Profile articles lack what their
+        citation view pages would add, but carry their urls as
+        'url_citation_view'.  Unknown pages yield (None, None).
+        """
+        for kind, marker in self.PAGE_TYPES:
+            if marker in html:
+                break
+        else:
+            return None, None
+
+        if kind == 'results':
+            return kind, self._parse_results(html)
+        if kind == 'profile':
+            articles = []
+            for article, url in self.CitationParser(self).parse_rows(html):
+                article['url_citation_view'] = url
+                articles.append(article)
+            return kind, articles
+        if kind == 'citation_view':
+            return kind, self.parse_citation_view(html)
+        return kind, self.parse_author_page(html)
+
     def parse_author_page(self, html):
         """
         This method allows parsing of an author page.
@@ -497,63 +2192,708 @@ class ScholarQuerier():
     def clear_articles(self):
         """Clears any existing articles stored from previous queries."""
         self.articles = []
+        self.partial = False
 
     def query_citation_view(self, url):
         """
-        This method initiates a query using the citation view url
+        This method initiates a query using the citation view url.
+        Concurrent queries for the same url share one fetch and parse,
+        and thus the returned dict.
         """
-        req = urllib2.Request(url=url,
-                              headers={'User-Agent': self.UA})
-        hdl = self.opener.open(req)
-        html = hdl.read()
-        return self.parse_citation_view(html)
+        info, shared = self.session.single_flight(
+            ('view', ScholarCache.normalize(url)),
+            lambda: self.parse_citation_view(self._fetch(url)))
+        if shared:
+            self.stats.count('saved_requests')
+        return info
 
     def parse_citation_view(self, html):
         parser = self.ViewCitationParser(self)
         return parser.parse(html)
 
+    def _fetch(self, url):
+        """
+        Retrieves the page at the given url.  With a cache configured,
+        fresh cached copies are served without a request, and fetched
+        pages are stored in the cache.  While the page is being fetched
+        for one querier of the session, others asking for it wait for
+        that fetch rather than making their own.
+        """
+        html, shared = self.session.single_flight(('fetch', ScholarCache.normalize(url)),
+                                                  lambda: self._fetch_page(url))
+        if shared:
+            self.stats.count('saved_requests')
+        return html
+
+    def _fetch_page(self, url):
+        if self.cache is not None:
+            html = self.cache.get(url)
+            if html is not None:
+                self.stats.count('cache_hits')
+                return html
+            if self.cache.offline:
+                raise ScholarCacheMiss('page not cached: %s' % url)
 
-def txt(query, author, count, search_author):
-    querier = ScholarQuerier(author=author, count=count, search_author=search_author)
+        req = urllib2.Request(url=url,
+                              headers={'User-Agent': self.UA})
+        try:
+            hdl = self.scheduler.open(self.opener, req, self.stats)
+            with self.stats.timing('read'):
+                html = hdl.read()
+        except Exception:
+            self.stats.count('errors')
+            raise
+        # Other handlers than KeepAliveHandler only give the decoded body:
+        self.stats.count('bytes', getattr(hdl, 'wire_length', len(html)))
 
-    if search_author:
-        querier.query_author(query)
-    else:
-        querier.query(query)
+        if self.cache is not None:
+            self.cache.put(url, html)
+        return html
 
-    articles = querier.articles
-    if count > 0:
-        articles = articles[:count]
-    for art in articles:
-        print art.as_txt() + '\n'
 
-def csv(query, author, count, search_author, header=False, sep='|'):
-    querier = ScholarQuerier(author=author, count=count, search_author=search_author)
+class AsyncScholarQuerier(object):
+    """
+    A non-blocking counterpart of ScholarQuerier.  Its query methods
+    return a ScholarFuture right away, while fetching and parsing run
+    on a pool of worker threads, with at most 'concurrency' queries in
+    progress.  Every query runs in its own ScholarQuerier, built from
+    the given author, count and further querier arguments, and all of
+    them share the session.  Event loops can pick up results via the
+    futures' add_done_callback().
+    """
+    def __init__(self, author='', count=0, concurrency=8, **querier_args):
+        self.author = author
+        self.count = count
+        self.querier_args = querier_args
+        self.pool = ScholarWorkerPool(concurrency)
 
-    if search_author:
-        querier.query_author(query)
+    def query(self, search):
+        """
+        Starts a query, the future yields the list of articles found.
+        """
+        return self.pool.submit(self._query, search, False)
+
+    def query_author(self, search):
+        """
+        Starts a search author query, the future yields the list of
+        articles in the author's profile.
+        """
+        return self.pool.submit(self._query, search, True)
+
+    def query_citation_view(self, url):
+        """
+        Starts a query of a citation view page, the future yields the
+        article information found there.
+        """
+        return self.pool.submit(self._querier(False).query_citation_view, url)
+
+    def close(self):
+        """
+        Stops the worker threads once all started queries are done.
+        """
+        self.pool.shutdown()
+
+    def _querier(self, search_author):
+        return ScholarQuerier(author=self.author, count=self.count,
+                              search_author=search_author, **self.querier_args)
+
+    def _query(self, search, search_author):
+        querier = self._querier(search_author)
+        if search_author:
+            querier.query_author(search)
+        else:
+            querier.query(search)
+        return querier.articles
+
+class ScholarResolver(object):
+    """
+    Resolves many article titles, per author, to their articles.  Every
+    article fetched along the way goes into an index by the author it
+    was queried for and its normalized title, and titles are looked up
+    there before any new query gets issued.  For an author with several
+    titles to resolve, one query for all of the author's articles, up
+    to count of them, comes first.  Titles still missing get queried
+    one by one.  With a fuzzy ratio between 0 and 1, a title matches
+    the indexed title of the author that is most similar to it, if at
+    least that similar.
+    """
+    # The fields that resolving needs:
+    FIELDS = ('title', 'url', 'year')
+
+    def __init__(self, fuzzy=None, count=100, **querier_args):
+        if querier_args.get('fields'):
+            querier_args['fields'] = tuple(querier_args['fields']) + \
+                tuple([key for key in self.FIELDS if key not in querier_args['fields']])
+        self.fuzzy = fuzzy
+        self.count = count
+        self.querier_args = querier_args
+        self.index = {}
+        # The normalized titles indexed for each author, as candidates
+        # for fuzzy matching:
+        self._author_titles = collections.defaultdict(set)
+        self._authors_fetched = set()
+
+    def add(self, articles, author=''):
+        """
+        Adds the given articles of the author to the index.
+        """
+        for art in articles:
+            if art['title']:
+                key = _normalize_title(art['title'])
+                self.index.setdefault((author, key), art)
+                self._author_titles[author].add(key)
+
+    def lookup(self, title, author=''):
+        """
+        Returns the indexed article for the given title, or None,
+        without issuing any query.
+        """
+        key = _normalize_title(title)
+        art = self.index.get((author, key))
+        if art is None and self.fuzzy:
+            import difflib
+            matches = difflib.get_close_matches(key, self._author_titles[author], 1, self.fuzzy)
+            if matches:
+                art = self.index[(author, matches[0])]
+        return art
+
+    def resolve(self, title, author=''):
+        """
+        Returns the article for the given title of the author, or None.
+        """
+        art = self.lookup(title, author)
+        if art is None:
+            querier = ScholarQuerier(author=author, **self.querier_args)
+            querier.query(title)
+            self.add(querier.articles, author)
+            art = self.lookup(title, author)
+        return art
+
+    def resolve_many(self, entries):
+        """
+        Generator that resolves the given (title, author) pairs and
+        yields (title, author, article) triples, where article is None
+        for unresolved titles.  The titles get batched per author, so
+        the triples come in the order in which the authors first
+        appear.
+        """
+        batches = OrderedDict()
+        for title, author in entries:
+            batches.setdefault(author, []).append(title)
+
+        for author, titles in batches.items():
+            missing = [title for title in titles if self.lookup(title, author) is None]
+            if author and len(missing) > 1 and author not in self._authors_fetched:
+                self._authors_fetched.add(author)
+                querier = ScholarQuerier(author=author, count=self.count, **self.querier_args)
+                self.add(querier.iter_articles('', limit=self.count), author)
+            for title in titles:
+                yield title, author, self.resolve(title, author)
+
+class ScholarCrawler(object):
+    """
+    Crawls the citation graph breadth-first, from seed articles along
+    their "cited by" lists.  Articles are keyed as in ScholarStore, by
+    their cluster IDs where possible, and each one gets expanded at
+    most once: by fetching up to count articles citing it, as long as
+    it is less than max_depth citations away from a seed.  Once
+    max_nodes articles are known, the crawl stops taking on new ones.
+    Up to workers expansions run concurrently, behind one scheduler
+    unless querier_args bring their own.
+
+    The crawl writes JSON lines to out as it goes: one with the key,
+    depth and fields of every article found, and one for every
+    citation, as an edge from the citing to the cited article's key.
+    With a checkpoint file, the known articles and the frontier get
+    saved there after every expansion, and a later crawler given the
+    same file resumes where the previous one stopped.
+    """
+    def __init__(self, max_depth=1, max_nodes=1000, count=10, workers=4, rate=1.0,
+                 checkpoint=None, out=sys.stdout, **querier_args):
+        if 'scheduler' not in querier_args:
+            querier_args['scheduler'] = ScholarScheduler(rate=rate)
+        if querier_args.get('fields'):
+            # Following and keying articles needs these:
+            querier_args['fields'] = tuple(querier_args['fields']) + \
+                tuple([key for key in ('url_citations', 'url_versions')
+                       if key not in querier_args['fields']])
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.count = count
+        self.workers = workers
+        self.checkpoint = checkpoint
+        self.out = out
+        self.querier_args = querier_args
+        # Whether the scheduler's deadline cut the crawl short:
+        self.partial = False
+        self.known = set()
+        # Articles still to expand, as (key, depth, url_citations):
+        self.frontier = collections.deque()
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as fh:
+                state = json.load(fh)
+            self.known = set(state['known'])
+            self.frontier.extend([tuple(item) for item in state['frontier']])
+
+    def crawl(self, seeds=()):
+        """
+        Adds the given seed articles, unless known already, and crawls
+        until the frontier is exhausted or the deadline has passed.
+        Returns the number of articles that failed to expand.
+        """
+        for art in seeds:
+            self._discover(art, 0)
+
+        failures = 0
+        in_flight = {}
+        results = Queue.Queue()
+        pool = ScholarWorkerPool(self.workers)
+        try:
+            while self.frontier or in_flight:
+                while self.frontier and len(in_flight) < 2 * self.workers and not self.partial:
+                    item = self.frontier.popleft()
+                    in_flight[item[0]] = item
+                    pool.submit(self._expand, item, results)
+                if not in_flight:
+                    break
+
+                key, citing, error = _queue_get(results)
+                item = in_flight.pop(key)
+                if error is None:
+                    for art in citing:
+                        citing_key = self._discover(art, item[1] + 1)
+                        if citing_key is not None:
+                            self._write({'edge': [citing_key, key]})
+                elif isinstance(error, ScholarDeadlineExceeded):
+                    # Leave the article for a resumed crawl:
+                    self.partial = True
+                    self.frontier.appendleft(item)
+                else:
+                    failures += 1
+                    self._write({'node': key, 'error': str(error) or error.__class__.__name__})
+                self._save(in_flight.values())
+        finally:
+            pool.shutdown(cancel=True)
+        return failures
+
+    def _discover(self, art, depth):
+        # Returns the article's key, unless it is new and over budget.
+        key = ScholarStore.article_key(art)
+        if key in self.known:
+            return key
+        if len(self.known) >= self.max_nodes:
+            return None
+        self.known.add(key)
+        self._write({'node': key, 'depth': depth, 'article': art.as_dict()})
+        if depth < self.max_depth and art['url_citations']:
+            self.frontier.append((key, depth, art['url_citations']))
+        return key
+
+    def _expand(self, item, results):
+        key, depth, url = item
+        try:
+            querier = ScholarQuerier(count=self.count, **self.querier_args)
+            citing = list(querier.iter_citations(url, limit=self.count))
+            if querier.partial:
+                raise ScholarDeadlineExceeded('deadline exceeded')
+            results.put((key, citing, None))
+        except Exception, err:
+            results.put((key, None, err))
+
+    def _write(self, result):
+        self.out.write(json.dumps(result) + '\n')
+        self.out.flush()
+
+    def _save(self, in_flight):
+        if not self.checkpoint:
+            return
+        # Expansions still in flight get redone on resumption:
+        state = {'known': sorted(self.known),
+                 'frontier': list(in_flight) + list(self.frontier)}
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.checkpoint)))
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(state, fh)
+        os.rename(tmpname, self.checkpoint)
+
+class ScholarRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answers POST requests to /<method> with a JSON object of arguments,
+    see ScholarServer.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            args = json.loads(self.rfile.read(length) or '{}')
+            code, res = 200, self.server.call(self.path.strip('/'), args)
+        except (ValueError, TypeError, KeyError), err:
+            code, res = 400, {'error': str(err) or err.__class__.__name__}
+        except Exception, err:
+            code, res = 500, {'error': str(err) or err.__class__.__name__}
+        body = json.dumps(res)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+class ScholarServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A long-running local HTTP server that answers JSON requests like
+    the module's query functions would, keeping its session, and thus
+    cookies, open connections and page layout, as well as any cache
+    warm between requests.  Requests get handled concurrently.  POST a
+    JSON object of arguments to one of these paths:
+
+    /query         query, author, count, search_author, fields
+    /query_author  author, count, fields
+    /url           title, author
+    /titles        author
+
+    The answers are JSON objects: {"articles": [...], "partial": ...}
+    for queries, {"url": ..., "year": ...} and {"titles": [...]}, or
+    {"error": ...} with status 400 or 500.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    PORT = 8642
+    METHODS = ('query', 'query_author', 'url', 'titles')
+
+    def __init__(self, port=PORT, host='127.0.0.1', **querier_args):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), ScholarRequestHandler)
+        querier_args.setdefault('session', ScholarSession.shared())
+        self.querier_args = querier_args
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def call(self, method, args):
+        """
+        Runs the named method with the given arguments, and returns the
+        result as a dict.
+        """
+        if method not in self.METHODS:
+            raise KeyError('unknown method: %s' % method)
+        # Scholar's URLs take the author in UTF-8:
+        author = args.get('author', u'').encode('utf-8')
+        if method in ('query', 'query_author'):
+            search_author = method == 'query_author' or bool(args.get('search_author'))
+            count = int(args.get('count', 0))
+            querier_args = dict(self.querier_args)
+            if args.get('fields'):
+                querier_args['fields'] = [str(key) for key in args['fields']]
+            querier = ScholarQuerier(author=author, count=count, search_author=search_author,
+                                     **querier_args)
+            articles = _iter_articles(querier, args.get('query', u''), count, search_author)
+            articles = [art.as_dict() for art in articles]
+            return {'articles': articles, 'partial': querier.partial}
+        if method == 'url':
+            url_, year = url(args['title'], author, **self.querier_args)
+            return {'url': url_, 'year': year}
+        return {'titles': titles(author, **self.querier_args)}
+
+class ScholarClient(object):
+    """
+    A client for the ScholarServer at server_url.  Its methods mirror
+    the module's query functions.  They raise urllib2.URLError when the
+    server cannot be reached, and ScholarServerError when the server
+    failed to answer the request.
+    """
+    def __init__(self, server_url, timeout=None):
+        self.server_url = server_url.rstrip('/')
+        self.timeout = timeout
+        # The server is local, so no proxies:
+        self.opener = urllib2.build_opener(urllib2.ProxyHandler({}))
+
+    def query(self, search, author='', count=0, search_author=False, fields=None):
+        res = self._call('query', query=search, author=author, count=count,
+                         search_author=search_author, fields=fields)
+        articles = []
+        for info in res['articles']:
+            art = Article()
+            for key, val in info.items():
+                art[key] = val
+            art.project(info.keys())
+            articles.append(art)
+        return articles
+
+    def query_author(self, author, count=0, fields=None):
+        return self.query('', author, count, search_author=True, fields=fields)
+
+    def url(self, title, author=''):
+        res = self._call('url', title=title, author=author)
+        return res['url'], res['year']
+
+    def titles(self, author=''):
+        return self._call('titles', author=author)['titles']
+
+    def _call(self, method, **args):
+        for key, val in args.items():
+            if isinstance(val, str):
+                args[key] = val.decode('utf-8')
+        req = urllib2.Request(self.server_url + '/' + method, json.dumps(args),
+                              {'Content-Type': 'application/json'})
+        try:
+            hdl = self.opener.open(req, timeout=self.timeout)
+        except urllib2.HTTPError, err:
+            try:
+                msg = json.loads(err.read())['error']
+            except (ValueError, KeyError):
+                msg = str(err)
+            raise ScholarServerError(msg)
+        return json.loads(hdl.read(), object_pairs_hook=OrderedDict)
+
+class ScholarServerError(Exception):
+    """
+    Raised by a ScholarClient when the server failed to answer.
+    """
+
+def _iter_archive(path):
+    """
+    Yields (name, html) for every page in the archive at path, which is
+    either a directory tree or a possibly compressed tar file.  Tar
+    files get read sequentially, one member at a time.
+    """
+    if os.path.isdir(path):
+        for dirpath, dirnames, fnames in os.walk(path):
+            dirnames.sort()
+            for fname in sorted(fnames):
+                fname = os.path.join(dirpath, fname)
+                with open(fname, 'rb') as fh:
+                    yield os.path.relpath(fname, path), fh.read()
     else:
+        import tarfile
+        with contextlib.closing(tarfile.open(path, 'r|*')) as tar:
+            for member in tar:
+                if member.isfile():
+                    yield member.name, tar.extractfile(member).read()
+
+def _parse_archived_page(name, html):
+    # Runs in the worker processes of iter_parsed_archive(). Failures
+    # get reported along with the results of the other pages:
+    try:
+        kind, res = ScholarQuerier().parse_page(html)
+        result = {'page': name, 'type': kind}
+        if kind is None:
+            result['error'] = 'unknown kind of page'
+        elif kind in ('results', 'profile'):
+            result['articles'] = [art.as_dict() for art in res]
+        elif kind == 'citation_view':
+            result['info'] = res
+        else:
+            result['url'] = res
+        return result
+    except Exception, err:
+        return {'page': name, 'error': str(err) or err.__class__.__name__}
+
+def iter_parsed_archive(path, processes=None):
+    """
+    Generator that parses the saved pages in the archive at path, see
+    _iter_archive(), across a pool of processes.  Yields a dict per
+    page as soon as it is parsed, so not in archive order: the page
+    name and kind, and what ScholarQuerier.parse_page() found there, or
+    an error message.  At most twice as many pages as there are
+    processes are in flight, which bounds memory use however large the
+    archive.
+    """
+    import multiprocessing
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    # The (page name, AsyncResult) pairs in flight:
+    pending = []
+
+    def finished():
+        # Waits in slices, so that Ctrl-C still gets through, until a
+        # page is done, and returns the results of all pages done.  A
+        # result that failed to get back from its worker, say as it
+        # could not be pickled, gets reported as the page's error.
+        while True:
+            done = [item for item in pending if item[1].ready()]
+            if done:
+                break
+            pending[0][1].wait(0.1)
+        results = []
+        for item in done:
+            pending.remove(item)
+            try:
+                results.append(item[1].get())
+            except Exception, err:
+                results.append({'page': item[0], 'error': str(err) or err.__class__.__name__})
+        return results
+
+    try:
+        for name, html in _iter_archive(path):
+            if len(pending) >= 2 * processes:
+                for result in finished():
+                    yield result
+            pending.append((name, pool.apply_async(_parse_archived_page, (name, html))))
+        while pending:
+            for result in finished():
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def parse_archive(path, processes=None, out=sys.stdout):
+    """
+    Parses the saved pages in the archive at path and writes the
+    results as JSON lines to out.  Returns the number of pages that
+    failed to parse.
+    """
+    failures = 0
+    for result in iter_parsed_archive(path, processes):
+        if 'error' in result:
+            failures += 1
+        out.write(json.dumps(result) + '\n')
+        out.flush()
+    return failures
+
+def _iter_articles(querier, query, count, search_author):
+    """
+    Yields the articles for the command-line query as they get parsed,
+    stopping at count articles.  Without a count, this covers the first
+    results page.
+    """
+    if search_author:
+        return querier.iter_author_articles(query, limit=count)
+    if count == 0:
         querier.query(query)
+        return iter(querier.articles)
+    return querier.iter_articles(query, limit=count)
 
-    articles = querier.articles
-    if count > 0:
-        articles = articles[:count]
-    for art in articles:
+def txt(query, author, count, search_author, store=None, **querier_args):
+    querier = ScholarQuerier(author=author, count=count, search_author=search_author,
+                             **querier_args)
+
+    for art in _iter_articles(querier, query, count, search_author):
+        print art.as_txt() + '\n'
+        sys.stdout.flush()
+        if store is not None:
+            store.add(art)
+
+def csv(query, author, count, search_author, header=False, sep='|', store=None,
+        **querier_args):
+    querier = ScholarQuerier(author=author, count=count, search_author=search_author,
+                             **querier_args)
+
+    for art in _iter_articles(querier, query, count, search_author):
         result = art.as_csv(header=header, sep=sep)
         print result.encode('utf-8')
+        sys.stdout.flush()
         header = False
+        if store is not None:
+            store.add(art)
 
-def url(title, author):
-    querier = ScholarQuerier(author=author)
-    querier.query(title)
-    articles = querier.articles
-    for article in articles:
-        if "".join(title.lower().split()) == "".join(article['title'].lower().split()):
-            return article['url'], article['year']
-    return None, None
+# The output sinks by format name, see --format:
+SINKS = {'txt': TxtSink, 'csv': CsvSink, 'tsv': TsvSink, 'jsonl': JsonLinesSink,
+         'sqlite': StoreSink}
 
-def titles(author):
-    querier = ScholarQuerier(author=author)
+def export(query, author, count, search_author, sink, store=None, **querier_args):
+    """
+    Like txt() and csv(), but writes the articles to the given
+    ScholarSink, and closes it when done.
+    """
+    querier = ScholarQuerier(author=author, count=count, search_author=search_author,
+                             **querier_args)
+    try:
+        for art in _iter_articles(querier, query, count, search_author):
+            sink.write(art)
+            if store is not None:
+                store.add(art)
+    finally:
+        sink.close()
+
+def _print_articles(articles, fmt='txt', header=False, sep='|'):
+    for art in articles:
+        if fmt == 'csv':
+            print art.as_csv(header=header, sep=sep).encode('utf-8')
+            header = False
+        else:
+            print art.as_txt() + '\n'
+        sys.stdout.flush()
+
+def find(store, query, author, count, fmt='txt', header=False, sep='|', fields=None):
+    """
+    Prints the articles in the store whose titles contain all words of
+    the query and whose authors include the given author, most cited
+    first, without touching the network.
+    """
+    articles = store.find(author=author, words=query, limit=count)
+    if fields:
+        for art in articles:
+            art.project(fields)
+    _print_articles(articles, fmt, header, sep)
+
+def sync(author, snapshot, fmt='txt', header=False, sep='|', **querier_args):
+    """
+    Syncs the snapshot of the author's profile and prints the changes,
+    marked in an additional 'change' field.
+    """
+    # The snapshot needs all fields, so project only what gets printed:
+    fields = querier_args.pop('fields', None)
+    querier = ScholarQuerier(author=author, search_author=True, **querier_args)
+    articles = []
+    for change, art in querier.sync_author('', snapshot):
+        if fields:
+            art.project(fields)
+        art['change'] = change
+        articles.append(art)
+    _print_articles(articles, fmt, header, sep)
+
+def crawl(query, author, count, search_author, max_depth=1, max_nodes=1000,
+          workers=4, rate=1.0, checkpoint=None, **querier_args):
+    """
+    Crawls the citation graph from the articles the command-line query
+    finds, see ScholarCrawler, and prints it as JSON lines.  A crawl
+    resumed from its checkpoint doesn't query its seeds again.  Returns
+    the number of articles that failed to expand.
+    """
+    crawler = ScholarCrawler(max_depth=max_depth, max_nodes=max_nodes, count=count or 10,
+                             workers=workers, rate=rate, checkpoint=checkpoint, **querier_args)
+    seeds = []
+    if not crawler.known:
+        querier = ScholarQuerier(author=author, count=count, search_author=search_author,
+                                 **crawler.querier_args)
+        seeds = _iter_articles(querier, query, count, search_author)
+    return crawler.crawl(seeds)
+
+def url(title, author, **querier_args):
+    querier_args.setdefault('fields', ScholarResolver.FIELDS)
+    article = ScholarResolver(**querier_args).resolve(title, author)
+    if article is None:
+        return None, None
+    return article['url'], article['year']
+
+def resolve(entries, fuzzy=None, out=sys.stdout, **querier_args):
+    """
+    Resolves the given (title, author) pairs to urls and years, and
+    writes each result as a JSON line to out.  Returns the number of
+    unresolved titles.
+    """
+    unresolved = 0
+    querier_args.setdefault('fields', ScholarResolver.FIELDS)
+    resolver = ScholarResolver(fuzzy=fuzzy, **querier_args)
+    for title, author, art in resolver.resolve_many(entries):
+        result = {'title': title, 'author': author, 'url': None, 'year': None}
+        if art is None:
+            unresolved += 1
+        else:
+            result.update({'url': art['url'], 'year': art['year'],
+                           'matched_title': art['title']})
+        out.write(json.dumps(result) + '\n')
+        out.flush()
+    return unresolved
+
+def titles(author, **querier_args):
+    querier_args.setdefault('fields', ('title',))
+    querier = ScholarQuerier(author=author, **querier_args)
     querier.query('')
     articles = querier.articles
     titles = []
@@ -561,6 +2901,96 @@ def titles(author):
       titles.append(article['title'])
     return titles
 
+def metrics(authors, workers=4, rate=1.0, use_numpy=None, out=sys.stdout, **querier_args):
+    """
+    Fetches the profiles of the given authors through a pool of
+    workers, like batch() does, and writes their bibliometrics, see
+    ScholarMetrics, as JSON lines to out.  Only the profile tables get
+    fetched, as they hold the citations and years.  Returns the number
+    of authors whose profiles failed to load.
+    """
+    if 'scheduler' not in querier_args:
+        querier_args['scheduler'] = ScholarScheduler(rate=rate)
+
+    def load(author):
+        querier = ScholarQuerier(author=author.encode('utf-8'), search_author=True,
+                                 **querier_args)
+        return [article for article, url in querier._iter_profile_rows()]
+
+    authors = [author.decode('utf-8') if isinstance(author, str) else author
+               for author in authors]
+    authors = [author.strip() for author in authors if author.strip()]
+    pool = ScholarWorkerPool(workers)
+    futures = [pool.submit(load, author) for author in authors]
+    stats = ScholarMetrics(use_numpy)
+    failures = 0
+    for author, future in zip(authors, futures):
+        try:
+            stats.add(author, future.result())
+        except Exception, err:
+            failures += 1
+            out.write(json.dumps({'author': author,
+                                  'error': str(err) or err.__class__.__name__}) + '\n')
+    pool.shutdown()
+    for result in stats.compute():
+        out.write(json.dumps(result) + '\n')
+    out.flush()
+    return failures
+
+def batch(queries, author, count, search_author, workers=4, rate=1.0,
+          out=sys.stdout, store=None, **querier_args):
+    """
+    Runs many queries through a pool of workers that share one
+    scheduler, and thus its rate limit, unless querier_args bring their
+    own.  Each result is written to out as a JSON line as soon as
+    its query completes, tagged with the query.  In search author mode
+    the queries name the authors.  A failed query yields a line with an
+    error message instead of articles.  With a store, the articles also
+    get saved there.  Returns the number of failed queries.
+    """
+    if 'scheduler' not in querier_args:
+        querier_args['scheduler'] = ScholarScheduler(rate=rate)
+    results = Queue.Queue()
+
+    def run(query):
+        try:
+            if search_author:
+                querier = ScholarQuerier(author=query.encode('utf-8'), count=count,
+                                         search_author=True, **querier_args)
+                articles = list(querier.iter_author_articles(query, limit=count))
+            else:
+                querier = ScholarQuerier(author=author, count=count, **querier_args)
+                querier.query(query)
+                articles = querier.articles
+                if count > 0:
+                    articles = articles[:count]
+            result = {'query': query, 'articles': [art.as_dict() for art in articles]}
+            if querier.partial:
+                result['partial'] = True
+            results.put((result, articles))
+        except Exception, err:
+            results.put(({'query': query, 'error': str(err) or err.__class__.__name__}, []))
+
+    pool = ScholarWorkerPool(workers)
+    num_queries = 0
+    for query in queries:
+        query = query.strip()
+        if query:
+            pool.submit(run, query.decode('utf-8'))
+            num_queries += 1
+
+    failures = 0
+    for _ in range(num_queries):
+        result, articles = _queue_get(results)
+        if 'error' in result:
+            failures += 1
+        out.write(json.dumps(result) + '\n')
+        out.flush()
+        if store is not None:
+            store.add_many(articles)
+    pool.shutdown()
+    return failures
+
 def main():
     usage = """scholar.py [options] <query string>
 A command-line interface to Google Scholar."""
@@ -578,27 +3008,245 @@ A command-line interface to Google Scholar."""
                       help='Like --csv, but print header line with column names')
     parser.add_option('--txt', action='store_true',
                       help='Print article data in text format')
+    parser.add_option('--format', choices=sorted(SINKS.keys()),
+                      help='Write articles in this format, buffered: %s' % ', '.join(sorted(SINKS)))
+    parser.add_option('--output', metavar='FILE',
+                      help='Write articles to FILE instead of stdout (implies --format txt)')
     parser.add_option('-c', '--count', type='int',
                       help='Maximum number of results')
-    parser.set_defaults(count=0, author='')
+    parser.add_option('--max-works', type='int', metavar='N',
+                      help='Take at most N works from an author\'s profile (default: all)')
+    parser.add_option('--fields', metavar='F1,F2,...',
+                      help='Extract and print only these article fields, out of: %s'
+                      % ', '.join(Article.KEYS))
+    parser.add_option('--cache-dir', metavar='DIR',
+                      help='Cache fetched pages in this directory')
+    parser.add_option('--offline', action='store_true',
+                      help='Serve pages from the cache only, never from the network')
+    parser.add_option('--cookie-file', metavar='FILE',
+                      help='Load cookies from FILE, and save them there when done')
+    parser.add_option('--stats', action='store_true',
+                      help='Print timing and counter statistics to stderr when done')
+    parser.add_option('--stats-json', metavar='FILE',
+                      help='Write the statistics as JSON to FILE when done')
+    parser.add_option('--sync', metavar='FILE',
+                      help='Sync the snapshot of the author\'s profile in FILE, print changes only')
+    parser.add_option('--store', metavar='FILE',
+                      help='Also save the articles in the SQLite store FILE')
+    parser.add_option('--find', action='store_true',
+                      help='Search the store (see --store) instead of Scholar, '
+                      'by title words and --author')
+    parser.add_option('--batch', metavar='FILE',
+                      help='Run the queries in FILE, one per line ("-" for stdin), '
+                      'and print JSON lines')
+    parser.add_option('--resolve', metavar='FILE',
+                      help='Resolve the titles in FILE ("-" for stdin) to urls and years, '
+                      'one per line and optionally followed by a tab and the author '
+                      '(default: --author), and print JSON lines')
+    parser.add_option('--fuzzy', type='float', metavar='R',
+                      help='Let --resolve accept titles with a similarity of at least R (0-1)')
+    parser.add_option('--parse-archive', metavar='PATH',
+                      help='Parse the saved pages in directory or tar file PATH, '
+                      'offline, and print JSON lines')
+    parser.add_option('--processes', type='int', metavar='N',
+                      help='Number of parsing processes for --parse-archive (default: one per CPU)')
+    parser.add_option('--crawl', action='store_true',
+                      help='Crawl the articles citing the query\'s results, and print '
+                      'the citation graph as JSON lines')
+    parser.add_option('--crawl-depth', type='int', metavar='N',
+                      help='Follow citations up to N steps from the query\'s results (default: 1)')
+    parser.add_option('--crawl-nodes', type='int', metavar='N',
+                      help='Stop the crawl at N articles (default: 1000)')
+    parser.add_option('--checkpoint', metavar='FILE',
+                      help='Save the crawl\'s progress in FILE, and resume from it if present')
+    parser.add_option('--serve', action='store_true',
+                      help='Answer JSON requests on a local port until interrupted, see --port')
+    parser.add_option('--port', type='int', metavar='PORT',
+                      help='Port for --serve (default: %d)' % ScholarServer.PORT)
+    parser.add_option('--server', metavar='URL',
+                      help='Run queries on the scholar.py server at URL, if it is up, unless '
+                      'options that only apply locally are given (default: $SCHOLAR_SERVER)')
+    parser.add_option('--metrics', action='store_true',
+                      help='Print h-index, i10-index and citation statistics of the --author\'s '
+                      'profile, or of every author in the --batch file, as JSON lines')
+    parser.add_option('--batch-workers', type='int', metavar='N',
+                      help='Number of concurrent queries in batch and crawl mode')
+    parser.add_option('--rate', type='float', metavar='R',
+                      help='Maximum requests per second (default: 1 in batch mode, no limit otherwise)')
+    parser.add_option('--timeout', type='float', metavar='SECS',
+                      help='Timeout for each request (default: 30)')
+    parser.add_option('--retries', type='int', metavar='N',
+                      help='Retries of throttled or timed out requests (default: 4)')
+    parser.add_option('--deadline', type='float', metavar='SECS',
+                      help='Stop fetching after SECS seconds and report partial results')
+    parser.set_defaults(count=0, author='', batch_workers=4,
+                        crawl_depth=1, crawl_nodes=1000, port=ScholarServer.PORT,
+                        server=os.environ.get('SCHOLAR_SERVER'))
     options, args = parser.parse_args()
 
     # in search author mode i don't need a query string
-    if ((len(args) == 0) and (not options.search_author)):
+    if ((len(args) == 0) and (not options.search_author) and (not options.batch)
+        and (not options.sync) and (not options.find) and (not options.resolve)
+        and (not options.parse_archive) and (not options.serve) and (not options.metrics)):
         print 'Hrrrm. I  need a query string.'
         sys.exit(1)
 
-    query = ' '.join(args)
+    if options.sync and not options.author:
+        print 'Syncing a profile needs an author, see --author.'
+        sys.exit(1)
 
-    #sys.stderr.write('query: ' + query + "\n")
-    #sys.stderr.write('author: ' + options.author + "\n")
+    if options.offline and not options.cache_dir:
+        print 'Offline mode needs a cache, see --cache-dir.'
+        sys.exit(1)
 
-    if options.csv:
-        csv(query, author=options.author, count=options.count, search_author=options.search_author)
-    elif options.csv_header:
-        csv(query, author=options.author, count=options.count, search_author=options.search_author, header=True)
-    else:
-        txt(query, author=options.author, count=options.count, search_author=options.search_author)
+    if options.format or options.output:
+        modes = [name for name in ('sync', 'batch', 'crawl', 'resolve', 'metrics', 'serve',
+                                   'find', 'parse_archive')
+                 if getattr(options, name)]
+        if modes:
+            print '--format and --output do not apply to --%s.' % modes[0].replace('_', '-')
+            sys.exit(1)
+
+    if options.parse_archive:
+        sys.exit(1 if parse_archive(options.parse_archive, options.processes) else 0)
+
+    if options.metrics and not (options.author or options.batch):
+        print 'Metrics need an author, see --author, or a --batch file of authors.'
+        sys.exit(1)
+
+    fields = None
+    if options.fields:
+        fields = [key.strip() for key in options.fields.split(',') if key.strip()]
+        unknown = [key for key in fields if key not in Article.KEYS]
+        if unknown:
+            print 'Unknown fields: %s. See --help.' % ', '.join(unknown)
+            sys.exit(1)
+
+    if options.format == 'sqlite' and not options.output:
+        print 'The sqlite format needs a database file, see --output.'
+        sys.exit(1)
+
+    if options.find and not options.store:
+        print 'Searching the store needs a store, see --store.'
+        sys.exit(1)
+
+    store = None
+    if options.store:
+        store = ScholarStore(options.store)
+    if options.find:
+        try:
+            find(store, ' '.join(args), author=options.author, count=options.count,
+                 fmt='csv' if options.csv or options.csv_header else 'txt',
+                 header=options.csv_header, fields=fields)
+        finally:
+            store.close()
+        return
+
+    querier_args = {}
+    if fields:
+        querier_args['fields'] = fields
+    if options.max_works:
+        querier_args['max_works'] = options.max_works
+    if options.cache_dir:
+        querier_args['cache'] = ScholarCache(options.cache_dir, offline=options.offline)
+    session = querier_args['session'] = ScholarSession(options.cookie_file)
+    stats = querier_args['stats'] = ScholarStats()
+    default_rate = 1.0 if options.batch or options.crawl else None
+    querier_args['scheduler'] = ScholarScheduler(
+        rate=options.rate or default_rate,
+        timeout=30 if options.timeout is None else options.timeout,
+        retries=4 if options.retries is None else options.retries,
+        deadline=options.deadline)
+
+    failures = 0
+    try:
+        if options.metrics:
+            if options.batch:
+                authors = sys.stdin if options.batch == '-' else open(options.batch)
+            else:
+                authors = [options.author]
+            failures = metrics(authors, workers=options.batch_workers, **querier_args)
+        elif options.batch:
+            queries = sys.stdin if options.batch == '-' else open(options.batch)
+            failures = batch(queries, author=options.author, count=options.count,
+                             search_author=options.search_author,
+                             workers=options.batch_workers, store=store, **querier_args)
+        elif options.crawl:
+            failures = crawl(' '.join(args), author=options.author, count=options.count,
+                             search_author=options.search_author, max_depth=options.crawl_depth,
+                             max_nodes=options.crawl_nodes, workers=options.batch_workers,
+                             checkpoint=options.checkpoint, **querier_args)
+        elif options.resolve:
+            lines = sys.stdin if options.resolve == '-' else open(options.resolve)
+            entries = []
+            for line in lines:
+                parts = line.decode('utf-8').rstrip('\r\n').split('\t')
+                if parts[0].strip():
+                    entries.append((parts[0].strip(),
+                                    parts[1].strip() if len(parts) > 1 else options.author))
+            failures = resolve(entries, fuzzy=options.fuzzy, **querier_args)
+        elif options.serve:
+            server = ScholarServer(options.port, **querier_args)
+            sys.stderr.write('Serving on %s\n' % server.url)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        elif options.sync:
+            sync(options.author, options.sync, fmt='csv' if options.csv or options.csv_header else 'txt',
+                 header=options.csv_header, **querier_args)
+        elif options.format or options.output:
+            sink = SINKS[options.format or 'txt'](options.output)
+            export(' '.join(args), author=options.author, count=options.count,
+                   search_author=options.search_author, sink=sink, store=store, **querier_args)
+        else:
+            query = ' '.join(args)
+
+            #sys.stderr.write('query: ' + query + "\n")
+            #sys.stderr.write('author: ' + options.author + "\n")
+
+            # The server fetches with its own cache, session and limits,
+            # so options for those mean querying here:
+            local_only = [name for name in ('offline', 'cache_dir', 'cookie_file', 'max_works',
+                                            'deadline', 'timeout', 'retries', 'rate')
+                          if getattr(options, name) is not None]
+
+            articles = None
+            if options.server and not local_only:
+                # Without a server up, fall back to querying here:
+                try:
+                    articles = ScholarClient(options.server).query(
+                        query, options.author, options.count, options.search_author, fields)
+                except urllib2.URLError:
+                    pass
+
+            if articles is not None:
+                _print_articles(articles, fmt='csv' if options.csv or options.csv_header else 'txt',
+                                header=options.csv_header)
+                if store is not None:
+                    store.add_many(articles)
+            elif options.csv:
+                csv(query, author=options.author, count=options.count,
+                    search_author=options.search_author, store=store, **querier_args)
+            elif options.csv_header:
+                csv(query, author=options.author, count=options.count,
+                    search_author=options.search_author, header=True, store=store,
+                    **querier_args)
+            else:
+                txt(query, author=options.author, count=options.count,
+                    search_author=options.search_author, store=store, **querier_args)
+    finally:
+        session.save()
+        if store is not None:
+            store.close()
+        if options.stats:
+            sys.stderr.write(stats.summary() + '\n')
+        if options.stats_json:
+            with open(options.stats_json, 'w') as fh:
+                json.dump(stats.as_dict(), fh, indent=2, sort_keys=True)
+
+    if failures:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()